@@ -0,0 +1,40 @@
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+
+def main():
+    """Run the API server, optionally with several worker processes"""
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="python -m app", description="Run the WhatTheFridge API")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", "1")),
+        help="Number of worker processes (default: WEB_CONCURRENCY or 1)",
+    )
+    parser.add_argument("--reload", action="store_true", help="Reload on code changes (single worker only)")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Workers only see each other's conversations and caches through a shared store
+        if os.getenv("CACHE_BACKEND", "memory").lower() != "sqlite":
+            print("Multiple workers requested; using CACHE_BACKEND=sqlite so state is shared")
+            os.environ["CACHE_BACKEND"] = "sqlite"
+        os.environ.setdefault("CACHE_PATH", os.path.abspath(".cache/whatthefridge.db"))
+
+    import uvicorn
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        reload=args.reload and args.workers == 1,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+import time
+from typing import Optional
+
+# Stages never get a timeout shorter than this, even with the budget spent
+MIN_STAGE_TIMEOUT = 0.5
+# Optional stages (web search, inline enrichment) are skipped with less time than this left
+OPTIONAL_STAGE_SECONDS = float(os.getenv("OPTIONAL_STAGE_MIN_SECONDS", "1"))
+
+
+class Budget:
+    """Latency budget for one request, carried through the graph as state['deadline']"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+
+    @classmethod
+    def start(cls, seconds: Optional[float] = None) -> "Budget":
+        """Start a budget of `seconds`, defaulting to REQUEST_BUDGET_SECONDS (0 disables it)"""
+        if seconds is None:
+            seconds = float(os.getenv("REQUEST_BUDGET_SECONDS", "3"))
+        return cls(time.time() + seconds if seconds > 0 else None)
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Budget":
+        return cls(state.get('deadline'))
+
+    def remaining(self) -> float:
+        if self.deadline is None:
+            return float('inf')
+        return max(0.0, self.deadline - time.time())
+
+    def allows(self, seconds: float) -> bool:
+        """Whether at least `seconds` are left for an optional stage"""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: float) -> float:
+        """Timeout for the next upstream call: the remaining time, capped at the stage's own limit"""
+        return max(MIN_STAGE_TIMEOUT, min(cap, self.remaining()))
+
+
+def mark_skipped(state: dict, stage: str) -> None:
+    """Record that an optional stage was dropped to stay within the budget"""
+    state['partial'] = True
+    skipped = state.setdefault('skipped_stages', [])
+    if stage not in skipped:
+        skipped.append(stage)
@@ -1,6 +1,14 @@
+import copy
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, List, Optional, Tuple
+
 from langgraph.graph import StateGraph, END
 from .state import AgentState
 from .nodes import AgentNodes
+from .budget import Budget
+from ..services import capture
 
 
 class CookingAgentGraph:
@@ -14,9 +22,9 @@ class CookingAgentGraph:
         workflow = StateGraph(AgentState)
         
         # Add nodes for ingredient processing flow
-        workflow.add_node("process_ingredients", self.nodes.process_ingredients)
-        workflow.add_node("search_recipes", self.nodes.search_recipes)
-        workflow.add_node("extract_details", self.nodes.extract_recipe_details)
+        workflow.add_node("process_ingredients", capture.traced("process_ingredients", self.nodes.process_ingredients))
+        workflow.add_node("search_recipes", capture.traced("search_recipes", self.nodes.search_recipes))
+        workflow.add_node("extract_details", capture.traced("extract_details", self.nodes.extract_recipe_details))
         
         # Set entry point
         workflow.set_entry_point("process_ingredients")
@@ -31,13 +39,18 @@ class CookingAgentGraph:
     def _build_chat_graph(self) -> StateGraph:
         """Build a separate graph for chat interactions"""
         workflow = StateGraph(AgentState)
-        workflow.add_node("chat_agent", self.nodes.chat_agent)
+        workflow.add_node("chat_agent", capture.traced("chat_agent", self.nodes.chat_agent))
         workflow.set_entry_point("chat_agent")
         workflow.add_edge("chat_agent", END)
         return workflow.compile()
 
-    def process_ingredients_flow(self, ingredients: list, craving: str = None, image_data: bytes = None) -> dict:
-        """Run the full ingredient processing flow"""
+    def process_ingredients_flow(self, ingredients: list, craving: str = None, image_data: bytes = None,
+                                 budget_seconds: float = None, image_hash: str = None) -> dict:
+        """Run the full ingredient processing flow within a latency budget.
+
+        Optional stages are dropped when the budget runs low, in which case the
+        result has 'partial' set and lists them under 'skipped_stages'.
+        """
         initial_state: AgentState = {
             'ingredients': ingredients,
             'craving': craving,
@@ -49,22 +62,85 @@ class CookingAgentGraph:
             'utensils': None,
             'cooking_method': None,
             'current_step': 'start',
-            'error': None
+            'error': None,
+            'deadline': Budget.start(budget_seconds).deadline,
+            'partial': False,
+            'skipped_stages': []
         }
         
         if image_data:
             initial_state['image_data'] = image_data
+        if image_hash:
+            initial_state['image_hash'] = image_hash
         
-        result = self.graph.invoke(initial_state)
+        inputs = {'ingredients': ingredients, 'craving': craving, 'image_data': image_data,
+                  'image_hash': image_hash, 'budget_seconds': budget_seconds}
+        with capture.session('ingredients', inputs):
+            result = self.graph.invoke(initial_state)
+        # The deadline only applies to this request, not to later chat turns
+        result.pop('deadline', None)
         return result
 
+    def process_batch_flow(self, items: List[dict], concurrency: int = None,
+                           cancelled: Optional[threading.Event] = None) -> Iterator[Tuple[int, dict]]:
+        """Run the ingredient flow for many ingredient sets, yielding (index, result) as each finishes.
+
+        Items with the same ingredients and craving run once and share the result.
+        Distinct items run concurrently; searches, transcripts and pages they
+        have in common are fetched once through the shared service caches.
+        Once `cancelled` is set no further items are started and the generator stops.
+        """
+        if concurrency is None:
+            concurrency = int(os.getenv("BATCH_CONCURRENCY", "4"))
+        
+        groups = {}
+        for index, item in enumerate(items):
+            ingredients = [ing.strip() for ing in item.get('ingredients', []) if ing.strip()]
+            craving = (item.get('craving') or '').strip() or None
+            key = (tuple(sorted(ing.lower() for ing in ingredients)), (craving or '').lower())
+            if key not in groups:
+                groups[key] = (ingredients, craving, [])
+            groups[key][2].append(index)
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch")
+        try:
+            futures = {
+                executor.submit(self.process_ingredients_flow, ingredients=ingredients, craving=craving): indexes
+                for ingredients, craving, indexes in groups.values()
+            }
+            pending = set(futures)
+            while pending:
+                if cancelled is not None and cancelled.is_set():
+                    return
+                # Wake up now and then to notice a cancellation while items are still running
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if cancelled is not None and cancelled.is_set():
+                        return
+                    indexes = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {'error': f"Error processing ingredients: {str(e)}", 'recipes': []}
+                    for n, index in enumerate(indexes):
+                        # Each item gets its own state so later chat turns do not leak between them
+                        yield index, result if n == 0 else copy.deepcopy(result)
+        finally:
+            # Also runs when the consumer closes the generator early; queued items are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def chat(self, message: str, state: dict) -> dict:
         """Handle chat interaction"""
-        state['conversation_history'].append({
-            'role': 'user',
-            'content': message
-        })
-        
-        result = self.chat_graph.invoke(state)
+        with capture.session('chat', {'message': message, 'state': state}):
+            state['conversation_history'].append({
+                'role': 'user',
+                'content': message
+            })
+            # Pick up any details the background prefetch has finished since the last turn
+            state['recipes'] = [
+                recipe if recipe.get('enriched') else self.nodes.apply_cached_details(recipe)
+                for recipe in state.get('recipes', [])
+            ]
+            
+            result = self.chat_graph.invoke(state)
         return result
-
@@ -4,6 +4,11 @@ from ..services.gemini_service import GeminiService
 from ..services.youtube_service import YouTubeService
 from ..services.web_search_service import WebSearchService
 from ..services.image_service import ImageService
+from ..services import capture
+from ..services.cache_service import get_cache
+from .prefetch import PrefetchQueue
+from .budget import Budget, OPTIONAL_STAGE_SECONDS, mark_skipped
+from . import recipe_editor
 
 
 class AgentNodes:
@@ -12,14 +17,29 @@ class AgentNodes:
         self.youtube = YouTubeService()
         self.web_search = WebSearchService()
         self.image_service = ImageService()
+        self.prefetch = PrefetchQueue(self.enrich_recipe)
+        self.recognition_cache = get_cache("recognitions", maxsize=1024, ttl=7 * 24 * 3600)
 
     def process_ingredients(self, state: AgentState) -> AgentState:
         """Process ingredients from text or image"""
         try:
-            # If image is provided, use vision API
-            if 'image_data' in state and state.get('image_data'):
-                ingredients = self.gemini.recognize_ingredients_from_image(state['image_data'])
-                state['ingredients'] = ingredients
+            # If image is provided, use vision API unless this exact image was recognized before
+            image_hash = state.get('image_hash')
+            recognized = self.cached_recognition(image_hash)
+            if recognized is None and state.get('image_data'):
+                # With nothing typed the image is all there is, so it gets its full timeout
+                timeout = Budget.from_state(state).timeout(30) if state.get('ingredients') else 30
+                recognized = self.gemini.recognize_ingredients_from_image(state['image_data'], timeout=timeout)
+                if recognized:
+                    if image_hash:
+                        self.recognition_cache.set(image_hash, recognized)
+                else:
+                    # Failed or timed out: carry on with the typed ingredients
+                    mark_skipped(state, 'image_recognition')
+            if recognized:
+                state['ingredients'] = list(recognized)
+            # The image bytes are not needed past this point
+            state['image_data'] = None
             
             # Process ingredients into search query
             if state.get('ingredients'):
@@ -35,6 +55,12 @@ class AgentNodes:
             state['error'] = f"Error processing ingredients: {str(e)}"
             return state
 
+    def cached_recognition(self, image_hash: str):
+        """Ingredients previously recognized from the image with this content hash, if any"""
+        if not image_hash:
+            return None
+        return self.recognition_cache.get(image_hash)
+
     def search_recipes(self, state: AgentState) -> AgentState:
         """Search for recipes from YouTube and web"""
         try:
@@ -48,15 +74,20 @@ class AgentNodes:
             print(f"Searching recipes with query: {query}")
             recipes = []
             
+            budget = Budget.from_state(state)
+            
             # Search YouTube
-            youtube_results = self.youtube.search_recipes(query, max_results=3)
+            youtube_results = self.youtube.search_recipes(query, max_results=3, timeout=budget.timeout(10))
             print(f"Found {len(youtube_results)} YouTube results")
             recipes.extend(youtube_results)
             
-            # Search web
-            web_results = self.web_search.search_recipes(query, max_results=2)
-            print(f"Found {len(web_results)} web results")
-            recipes.extend(web_results)
+            # Search web, unless the budget is nearly spent
+            if budget.allows(OPTIONAL_STAGE_SECONDS):
+                web_results = self.web_search.search_recipes(query, max_results=2, timeout=budget.timeout(10))
+                print(f"Found {len(web_results)} web results")
+                recipes.extend(web_results)
+            else:
+                mark_skipped(state, 'web_search')
             
             print(f"Total recipes found: {len(recipes)}")
             state['recipes'] = recipes
@@ -71,28 +102,27 @@ class AgentNodes:
             return state
 
     def extract_recipe_details(self, state: AgentState) -> AgentState:
-        """Extract detailed recipe information"""
+        """Attach cached recipe details and queue the rest for background enrichment"""
         try:
             recipes = state.get('recipes', [])
+            budget = Budget.from_state(state)
             
-            for recipe in recipes:
-                if recipe.get('source') == 'youtube' and recipe.get('video_id'):
-                    # Get transcript
-                    transcript = self.youtube.get_transcript(recipe['video_id'])
-                    if transcript:
-                        recipe['transcript'] = transcript
-                        # Extract steps from transcript
-                        steps = self.youtube.extract_steps_from_transcript(transcript)
-                        recipe['steps'] = steps
-                
-                elif recipe.get('source') == 'web' and recipe.get('url'):
-                    # Extract from web page
-                    recipe_data = self.web_search.extract_recipe_from_url(recipe['url'])
-                    if recipe_data:
-                        recipe.update(recipe_data)
-                        # Use Gemini to format steps better
-                        if recipe_data.get('instructions'):
-                            recipe['steps'] = recipe_data['instructions']
+            for rank, recipe in enumerate(recipes):
+                enriched = self.apply_cached_details(recipe)
+                if self.details_pending(enriched):
+                    key = self.enrichment_key(recipe)
+                    # Fetch inline when the queue is full or disabled, or when capturing so the
+                    # archive holds every upstream response the request depends on
+                    if capture.is_active() or not self.prefetch.submit(rank, key, recipe):
+                        if budget.allows(OPTIONAL_STAGE_SECONDS):
+                            try:
+                                enriched = self.enrich_recipe(recipe, timeout=budget.timeout(10))
+                            except Exception as e:
+                                # One recipe's details failing should not cost the others theirs
+                                print(f"Error enriching {key}: {str(e)}")
+                        else:
+                            mark_skipped(state, 'extract_details')
+                recipes[rank] = enriched
             
             state['recipes'] = recipes
             state['current_step'] = 'details_extracted'
@@ -102,6 +132,54 @@ class AgentNodes:
             state['error'] = f"Error extracting recipe details: {str(e)}"
             return state
 
+    def enrichment_key(self, recipe: Dict[str, Any]):
+        """Identify the upstream resource a recipe is enriched from"""
+        if recipe.get('source') == 'youtube' and recipe.get('video_id'):
+            return ('youtube', recipe['video_id'])
+        if recipe.get('source') == 'web' and recipe.get('url'):
+            return ('web', recipe['url'])
+        return None
+
+    def details_pending(self, recipe: Dict[str, Any]) -> bool:
+        """Whether details for the recipe may still arrive; known misses are not retried"""
+        if recipe.get('enriched'):
+            return False
+        key = self.enrichment_key(recipe)
+        if key is None:
+            return False
+        if key[0] == 'youtube':
+            return not self.youtube.transcript_missing(key[1])
+        return not self.web_search.recipe_missing(key[1])
+
+    def enrich_recipe(self, recipe: Dict[str, Any], timeout: float = 10) -> Dict[str, Any]:
+        """Fetch transcript or page details for a recipe, filling the service caches"""
+        if recipe.get('source') == 'youtube' and recipe.get('video_id'):
+            self.youtube.get_transcript(recipe['video_id'], timeout=timeout)
+        elif recipe.get('source') == 'web' and recipe.get('url'):
+            self.web_search.extract_recipe_from_url(recipe['url'], timeout=timeout)
+        return self.apply_cached_details(recipe)
+
+    def apply_cached_details(self, recipe: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a copy of the recipe with whatever details are already cached merged in"""
+        enriched = dict(recipe)
+        if recipe.get('source') == 'youtube' and recipe.get('video_id'):
+            transcript = self.youtube.cached_transcript(recipe['video_id'])
+            if transcript:
+                enriched['transcript'] = transcript
+                # Extract steps from transcript
+                enriched['steps'] = self.youtube.extract_steps_from_transcript(transcript)
+                enriched['enriched'] = True
+        
+        elif recipe.get('source') == 'web' and recipe.get('url'):
+            recipe_data = self.web_search.cached_recipe(recipe['url'])
+            if recipe_data:
+                enriched.update(recipe_data)
+                if recipe_data.get('instructions'):
+                    enriched['steps'] = recipe_data['instructions']
+                enriched['enriched'] = True
+        
+        return enriched
+
     def chat_agent(self, state: AgentState) -> AgentState:
         """Handle chat interactions with Gemini"""
         try:
@@ -158,21 +236,8 @@ class AgentNodes:
                 })
                 
                 # Check if user wants to customize recipe
-                customize_keywords = ['change', 'modify', 'adjust', 'customize', 'edit', 'don\'t have', 'dont have', 'no oven', 'no gas']
-                if any(keyword in user_message.lower() for keyword in customize_keywords):
-                    if recipes:
-                        # Use first recipe if available
-                        selected_recipe = recipes[0]
-                        recipe_text = selected_recipe.get('transcript', selected_recipe.get('title', ''))
-                        if recipe_text:
-                            customized = self.gemini.customize_recipe(
-                                recipe_text,
-                                user_message,
-                                serving_size
-                            )
-                            if 'customized' not in selected_recipe:
-                                selected_recipe['customized'] = customized
-                            state['selected_recipe'] = selected_recipe
+                if recipes and recipe_editor.wants_customization(user_message):
+                    self.customize_selected_recipe(state, user_message)
                 
                 state['conversation_history'] = conversation_history
                 state['current_step'] = 'chat_completed'
@@ -185,3 +250,48 @@ class AgentNodes:
             state['error'] = f"Error in chat: {str(e)}"
             return state
 
+    def customize_selected_recipe(self, state: AgentState, user_message: str) -> None:
+        """Apply a change request to the conversation's current recipe version.
+
+        Serving-size changes are scaled locally when the recipe's servings are known;
+        substitutions, equipment changes and scaling from an unknown base go to the
+        model, and only with the ingredient lines and steps they affect.
+        """
+        selected_recipe = state.get('selected_recipe') or state['recipes'][0]
+        version = state.get('recipe_version')
+        if not version or version.get('url') != selected_recipe.get('url', ''):
+            version = recipe_editor.build_recipe_version(selected_recipe)
+        
+        if not version['steps']:
+            # Nothing structured to edit yet (e.g. transcript still loading): fall back to a full rewrite
+            recipe_text = selected_recipe.get('transcript') or selected_recipe.get('title', '')
+            customized = self.gemini.customize_recipe(recipe_text, user_message, state.get('serving_size'))
+            version['steps'] = self.gemini.parse_steps(customized) or [customized]
+            version = recipe_editor.apply_step_edits(version, {}, user_message)
+        else:
+            serving_change = recipe_editor.parse_serving_change(user_message)
+            scaled = serving_change is not None and recipe_editor.can_scale(version, serving_change)
+            if scaled:
+                version = recipe_editor.scale_recipe(version, serving_change)
+            if recipe_editor.needs_model(user_message, serving_change, version):
+                if serving_change and not scaled:
+                    step_indexes = recipe_editor.quantity_indexes(version['steps'])
+                    ingredient_indexes = recipe_editor.quantity_indexes(version['ingredients'])
+                else:
+                    step_indexes = recipe_editor.relevant_step_indexes(version, user_message)
+                    ingredient_indexes = recipe_editor.relevant_ingredient_indexes(version, user_message)
+                edits, ingredient_edits = self.gemini.customize_steps(
+                    version['title'],
+                    {i: version['steps'][i] for i in step_indexes},
+                    user_message,
+                    {i: version['ingredients'][i] for i in ingredient_indexes}
+                )
+                version = recipe_editor.apply_step_edits(version, edits, user_message, ingredient_edits)
+                if serving_change and not scaled:
+                    version['servings'] = serving_change['servings']
+            if serving_change:
+                state['serving_size'] = version.get('servings') or state.get('serving_size')
+        
+        state['recipe_version'] = version
+        selected_recipe['customized'] = recipe_editor.render_recipe(version)
+        state['selected_recipe'] = selected_recipe
@@ -0,0 +1,68 @@
+import itertools
+import os
+import queue
+import threading
+from typing import Any, Callable, Hashable, Optional, Set
+
+
+class PrefetchQueue:
+    """Background workers that enrich recipes by rank without blocking requests.
+
+    Jobs with a lower rank are picked up first; ties run in submission order.
+    The queue is bounded so a burst of requests cannot grow it without limit:
+    when it is full, submit() returns False and the caller enriches inline.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Any],
+        workers: Optional[int] = None,
+        maxsize: Optional[int] = None,
+    ):
+        self.handler = handler
+        self.workers = workers if workers is not None else int(os.getenv("PREFETCH_WORKERS", "2"))
+        maxsize = maxsize if maxsize is not None else int(os.getenv("PREFETCH_QUEUE_SIZE", "32"))
+        self.enabled = os.getenv("PREFETCH_ENABLED", "true").lower() not in ("0", "false", "no")
+        self.queue: "queue.PriorityQueue" = queue.PriorityQueue(maxsize=maxsize)
+        self._counter = itertools.count()
+        self._pending: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, rank: int, key: Hashable, item: Any) -> bool:
+        """Queue item for background enrichment; returns False if it must run inline"""
+        if not self.enabled or self.workers <= 0:
+            return False
+        self._ensure_started()
+        with self._lock:
+            if key in self._pending:
+                return True
+            try:
+                self.queue.put_nowait((rank, next(self._counter), key, item))
+            except queue.Full:
+                return False
+            self._pending.add(key)
+        return True
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"prefetch-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self) -> None:
+        while True:
+            _, _, key, item = self.queue.get()
+            try:
+                self.handler(item)
+            except Exception as e:
+                print(f"Error in prefetch job {key}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self.queue.task_done()
@@ -0,0 +1,255 @@
+import re
+from fractions import Fraction
+from typing import Any, Dict, List, Optional
+
+# Keywords that ask for a change to the recipe at all
+CUSTOMIZE_KEYWORDS = ['change', 'modify', 'adjust', 'customize', 'edit', 'don\'t have', 'dont have', 'no oven', 'no gas']
+# Keywords that need the model to rewrite steps rather than a local tweak
+SUBSTITUTION_KEYWORDS = ['don\'t have', 'dont have', 'no oven', 'no gas', 'instead of', 'replace', 'substitute', 'swap',
+                         'without', 'vegan', 'vegetarian', 'gluten', 'dairy', 'allergic', 'microwave', 'air fryer',
+                         'stovetop', 'spicy', 'healthier']
+# Equipment words and the step vocabulary that depends on them
+EQUIPMENT_TERMS = {
+    'oven': ['oven', 'bake', 'roast', 'preheat', 'broil'],
+    'gas': ['stove', 'burner', 'flame', 'heat', 'pan', 'boil', 'simmer', 'fry'],
+    'microwave': ['microwave'],
+    'grill': ['grill'],
+}
+UNITS = (r'cups?|tbsp|tablespoons?|tsp|teaspoons?|g|grams?|kg|ml|l|liters?|litres?|oz|ounces?|lbs?|pounds?|'
+         r'cloves?|pinch(?:es)?|cans?|slices?|pieces?|sticks?')
+UNICODE_FRACTIONS = {'½': '1/2', '⅓': '1/3', '⅔': '2/3', '¼': '1/4', '¾': '3/4', '⅛': '1/8'}
+STOPWORDS = {'the', 'a', 'an', 'and', 'or', 'to', 'of', 'i', 'my', 'me', 'it', 'is', 'can', 'you', 'please', 'with',
+             'for', 'in', 'on', 'this', 'that', 'recipe', 'have', 'dont', 'don\'t', 'no', 'use', 'make', 'instead'}
+
+QUANTITY = r'(?:\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)'
+_LEADING_QUANTITY = re.compile(rf'^\s*({QUANTITY})')
+_UNIT_QUANTITY = re.compile(rf'({QUANTITY})(\s*(?:{UNITS})\b)', re.IGNORECASE)
+# A quantity or a range of them ("2-3", "1 to 2"), not starting inside another number
+_AMOUNT = re.compile(rf'(?<![\d/.])({QUANTITY})(?:(\s*(?:-|–|to)\s*)({QUANTITY}))?', re.IGNORECASE)
+_SIZES = r'(?:(?:large|medium|small|whole)\s+)?'
+_UNIT_AFTER = re.compile(rf'\s*{_SIZES}(?:{UNITS})\b', re.IGNORECASE)
+# "2 large eggs": a count, then the word for what is counted
+_COUNTED_INGREDIENT = re.compile(rf'^{QUANTITY}\s*{_SIZES}([a-z]+)', re.IGNORECASE)
+
+
+# Serving-size requests: a count of people or servings, or a factor applied to the recipe as a whole
+_RECIPE_OBJECT = r'(?:it|(?:the|this|that|my)\s+(?:recipe|batch|quantities|amounts))'
+_SERVING_COUNT = [
+    re.compile(r'\b(\d+)\s+(?:people|persons|servings|portions|guests)\b'),
+    re.compile(rf'\b(?:scale|adjust|resize|change)\s+{_RECIPE_OBJECT}\s+(?:to|for)\s+(\d+)\b'),
+]
+_SERVING_FACTORS = [
+    (re.compile(rf'\bdouble\s+{_RECIPE_OBJECT}|\ba\s+double\s+batch\b'), 2.0),
+    (re.compile(rf'\btriple\s+{_RECIPE_OBJECT}|\ba\s+triple\s+batch\b'), 3.0),
+    (re.compile(rf'\bhalve\s+{_RECIPE_OBJECT}|\bhalf\s+(?:the|this|a)\s+(?:recipe|batch)\b|'
+                rf'\b(?:cut|scale)\s+{_RECIPE_OBJECT}\s+(?:in|by)\s+half\b'), 0.5),
+]
+
+
+def wants_customization(message: str) -> bool:
+    text = message.lower()
+    return any(keyword in text for keyword in CUSTOMIZE_KEYWORDS) or parse_serving_change(message) is not None
+
+
+def needs_model(message: str, serving_change: Optional[Dict[str, float]], version: Dict[str, Any]) -> bool:
+    """Whether the request goes beyond what can be applied locally"""
+    text = message.lower()
+    if any(keyword in text for keyword in SUBSTITUTION_KEYWORDS):
+        return True
+    return serving_change is None or not can_scale(version, serving_change)
+
+
+def parse_serving_change(message: str) -> Optional[Dict[str, float]]:
+    """Read a serving-size request: {'servings': n} or {'factor': f}"""
+    text = message.lower()
+    for pattern in _SERVING_COUNT:
+        match = pattern.search(text)
+        if match:
+            return {'servings': int(match.group(1))}
+    for pattern, factor in _SERVING_FACTORS:
+        if pattern.search(text):
+            return {'factor': factor}
+    return None
+
+
+def can_scale(version: Dict[str, Any], change: Dict[str, float]) -> bool:
+    """Whether a serving change can be applied locally; a target count needs the recipe's own servings"""
+    return 'factor' in change or bool(version.get('servings'))
+
+
+def build_recipe_version(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """Structured copy of a recipe that customizations are applied to"""
+    return {
+        'title': recipe.get('title', 'Customized Recipe'),
+        'url': recipe.get('url', ''),
+        'servings': _parse_servings(recipe.get('servings')),
+        'ingredients': list(recipe.get('ingredients') or []),
+        'steps': list(recipe.get('steps') or []),
+        'version': 1,
+        'changes': [],
+    }
+
+
+def scale_recipe(version: Dict[str, Any], change: Dict[str, float]) -> Dict[str, Any]:
+    """Scale ingredient quantities locally, without calling the model"""
+    if not can_scale(version, change):
+        raise ValueError("Cannot scale to a serving count without the recipe's own servings")
+    base = version.get('servings')
+    if 'factor' in change:
+        factor = change['factor']
+        target = base * factor if base else None
+    else:
+        target = change['servings']
+        factor = target / base
+
+    updated = dict(version)
+    if factor != 1.0:
+        ratio = Fraction(factor).limit_denominator(100)
+        # Steps mention counted ingredients ("beat 2 eggs") as well as measured ones
+        counted = _counted_pattern(version['ingredients'])
+        updated['ingredients'] = [_scale_quantities(line, ratio, leading=True) for line in version['ingredients']]
+        updated['steps'] = [_scale_quantities(step, ratio, counted=counted) for step in version['steps']]
+    if target:
+        updated['servings'] = round(target) if float(target).is_integer() else target
+        return _bump(updated, f"Scaled to {updated['servings']} servings")
+    return _bump(updated, f"Scaled x{factor:g}")
+
+
+def relevant_step_indexes(version: Dict[str, Any], message: str, limit: int = 8) -> List[int]:
+    """Indexes of the steps a change request touches, so only those go to the model"""
+    indexes = _matching_indexes(version['steps'], message)
+    if not indexes:
+        indexes = list(range(len(version['steps'])))
+    return indexes[:limit]
+
+
+def relevant_ingredient_indexes(version: Dict[str, Any], message: str) -> List[int]:
+    """Indexes of the ingredient lines a change request names, or all of them if it names none"""
+    return _matching_indexes(version['ingredients'], message) or list(range(len(version['ingredients'])))
+
+
+def quantity_indexes(lines: List[str]) -> List[int]:
+    """Indexes of the lines that carry a quantity, for scaling a recipe whose servings are unknown"""
+    return [i for i, line in enumerate(lines)
+            if _LEADING_QUANTITY.match(_normalize_fractions(line)) or _UNIT_QUANTITY.search(line)]
+
+
+def apply_step_edits(version: Dict[str, Any], edits: Dict[int, str], request: str,
+                     ingredient_edits: Optional[Dict[int, str]] = None) -> Dict[str, Any]:
+    """Replace edited steps (and ingredient lines) in place; the rest are kept as they were"""
+    updated = dict(version)
+    updated['steps'] = _replace_lines(version['steps'], edits)
+    updated['ingredients'] = _replace_lines(version['ingredients'], ingredient_edits or {})
+    return _bump(updated, request)
+
+
+def render_recipe(version: Dict[str, Any]) -> str:
+    """Plain-text form of a recipe version for the chat response"""
+    lines = [version['title']]
+    if version.get('servings'):
+        lines.append(f"Servings: {version['servings']}")
+    if version['ingredients']:
+        lines.append("\nIngredients:")
+        lines.extend(f"- {ingredient}" for ingredient in version['ingredients'])
+    if version['steps']:
+        lines.append("\nSteps:")
+        lines.extend(f"{i}. {step}" for i, step in enumerate(version['steps'], 1))
+    return "\n".join(lines)
+
+
+def _bump(version: Dict[str, Any], change: str) -> Dict[str, Any]:
+    version['version'] = version.get('version', 1) + 1
+    version['changes'] = list(version.get('changes', [])) + [change]
+    return version
+
+
+def _matching_indexes(lines: List[str], message: str) -> List[int]:
+    text = message.lower()
+    terms = {word for word in re.findall(r"[a-z']+", text) if len(word) > 2 and word not in STOPWORDS}
+    for equipment, words in EQUIPMENT_TERMS.items():
+        if equipment in text:
+            terms.update(words)
+    return [i for i, line in enumerate(lines) if any(term in line.lower() for term in terms)]
+
+
+def _replace_lines(lines: List[str], edits: Dict[int, str]) -> List[str]:
+    lines = list(lines)
+    for index, text in sorted(edits.items()):
+        if 0 <= index < len(lines):
+            lines[index] = text
+        elif index == len(lines):
+            lines.append(text)
+    return lines
+
+
+def _parse_servings(value: Any) -> Optional[int]:
+    if isinstance(value, int):
+        return value
+    match = re.search(r'\d+', str(value or ''))
+    return int(match.group()) if match else None
+
+
+def _parse(quantity: str) -> Fraction:
+    parts = quantity.split()
+    return sum((Fraction(part) for part in parts), Fraction(0))
+
+
+def _format(value: Fraction) -> str:
+    value = Fraction(value).limit_denominator(8)
+    whole, rest = divmod(value.numerator, value.denominator)
+    if rest == 0:
+        return str(whole)
+    fraction = f"{rest}/{value.denominator}"
+    return f"{whole} {fraction}" if whole else fraction
+
+
+def _normalize_fractions(line: str) -> str:
+    for symbol, fraction in UNICODE_FRACTIONS.items():
+        line = re.sub(rf'\s*{symbol}', f' {fraction}', line)
+    return line.lstrip()
+
+
+def _counted_pattern(ingredients: List[str]) -> Optional["re.Pattern"]:
+    """Matches the words ingredient lines count by ("eggs" in "2 large eggs"), singular or plural"""
+    stems = set()
+    for line in ingredients:
+        match = _COUNTED_INGREDIENT.match(_normalize_fractions(line))
+        if not match:
+            continue
+        word = match.group(1).lower()
+        if word in STOPWORDS or re.fullmatch(UNITS, word):
+            continue
+        stems.add(word)
+        if word.endswith('es'):
+            stems.add(word[:-2])
+        if word.endswith('s'):
+            stems.add(word[:-1])
+    if not stems:
+        return None
+    alternatives = '|'.join(sorted(map(re.escape, stems), key=len, reverse=True))
+    return re.compile(rf'\s*{_SIZES}(?:{alternatives})(?:e?s)?\b', re.IGNORECASE)
+
+
+def _scale_quantities(line: str, ratio: Fraction, leading: bool = False,
+                      counted: Optional["re.Pattern"] = None) -> str:
+    """Scale the quantities in a line that have a unit, lead the line (with leading) or count an ingredient.
+
+    Both ends of a range are scaled. The line is returned as it was if nothing in it was scaled.
+    """
+    normalized = _normalize_fractions(line)
+    scaled = 0
+
+    def replace(match: "re.Match") -> str:
+        nonlocal scaled
+        after = normalized[match.end():]
+        if not ((leading and match.start() == 0) or _UNIT_AFTER.match(after)
+                or (counted is not None and counted.match(after))):
+            return match.group(0)
+        scaled += 1
+        low = _format(_parse(match.group(1)) * ratio)
+        if match.group(3) is None:
+            return low
+        return low + match.group(2) + _format(_parse(match.group(3)) * ratio)
+
+    result = _AMOUNT.sub(replace, normalized)
+    return result if scaled else line
@@ -8,6 +8,7 @@ class AgentState(TypedDict, total=False):
     craving: Optional[str]
     recipes: List[Dict[str, Any]]
     selected_recipe: Optional[Dict[str, Any]]
+    recipe_version: Optional[Dict[str, Any]]  # structured recipe that chat customizations are applied to
     conversation_history: List[Dict[str, str]]
     user_preferences: Dict[str, Any]
     serving_size: Optional[int]
@@ -15,6 +16,10 @@ class AgentState(TypedDict, total=False):
     cooking_method: Optional[str]  # gas, oven, stovetop, etc.
     current_step: str
     error: Optional[str]
-    image_data: Optional[bytes]
+    image_data: Optional[bytes]  # cleared once recognized so it is not kept with the conversation
+    image_hash: Optional[str]  # SHA-256 of the uploaded image, keys the recognition cache
     search_query: Optional[str]
+    deadline: Optional[float]  # epoch seconds by which the current request must finish
+    partial: bool
+    skipped_stages: List[str]
 
@@ -1,16 +1,24 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
+from fastapi import FastAPI, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from dotenv import load_dotenv
 import os
-from typing import Optional, List
+import threading
+from typing import List
 import uuid
 
 from .models.schemas import (
-    IngredientInput, ChatMessage, RecipeResponse, 
-    ChatResponse, Recipe
+    IngredientInput, ChatMessage, ChatResponse, Recipe, RecipeResponse,
+    BatchIngredientsRequest, BatchItemResponse
 )
 from .agent.graph import CookingAgentGraph
+from .services.admission import get_admission, require_upstreams
+from .services.cache_service import get_cache
+from .services.cache_snapshot import load_snapshot, save_snapshot, snapshot_path, start_periodic_snapshots
+from .services.image_service import ImageService, UploadRejected, read_image_form
+from .services.serialization import encode_listing, encode_recipes
 
 load_dotenv()
 
@@ -27,9 +35,70 @@ app.add_middleware(
 
 # Initialize agent graph
 agent_graph = CookingAgentGraph()
+image_service = ImageService()
 
-# Store conversation states (in production, use Redis or database)
-conversation_states = {}
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Room for the multipart boundaries and text fields around the image
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+# Store conversation states; with CACHE_BACKEND=sqlite they are shared by all worker processes
+conversation_states = get_cache("conversations", maxsize=10000, ttl=24 * 3600)
+# Encoded recipe listings, keyed by conversation and whether transcripts are included
+recipe_listings = get_cache("recipe_listings", maxsize=10000, ttl=24 * 3600)
+MISSING_DETAILS_TTL = 1800
+
+
+@app.on_event("startup")
+def restore_cache_snapshot():
+    """Start from the caches a previous instance saved, if CACHE_SNAPSHOT is set"""
+    if not snapshot_path():
+        return
+    load_snapshot()
+    interval = float(os.getenv("CACHE_SNAPSHOT_INTERVAL", "0"))
+    if interval > 0:
+        app.state.snapshot_stop = start_periodic_snapshots(interval)
+
+
+@app.on_event("shutdown")
+def write_cache_snapshot():
+    stop = getattr(app.state, "snapshot_stop", None)
+    if stop is not None:
+        stop.set()
+    save_snapshot()
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Refuse oversized uploads from their Content-Length, before the form is parsed"""
+    if request.method == "POST" and request.url.path == "/api/ingredients":
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Image is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"}
+            )
+    return await call_next(request)
+
+
+def encoded_recipes(conversation_id: str, recipes: List[dict], include_transcripts: bool = False) -> bytes:
+    """JSON bytes of a conversation's recipes, merging in any enrichment that is ready"""
+    key = (conversation_id, include_transcripts)
+    encoded = recipe_listings.get(key)
+    if encoded is not None:
+        return encoded
+    nodes = agent_graph.nodes
+    recipes = [recipe if recipe.get('enriched') else nodes.apply_cached_details(recipe) for recipe in recipes]
+    encoded = encode_recipes(recipes, include_transcripts)
+    # Details may still arrive for the others, so only a settled listing is kept
+    if not any(nodes.details_pending(recipe) for recipe in recipes):
+        # Recipes without details are only known misses for a while; look again after that
+        complete = all(recipe.get('enriched') or nodes.enrichment_key(recipe) is None for recipe in recipes)
+        recipe_listings.set(key, encoded, ttl=None if complete else MISSING_DETAILS_TTL)
+    return encoded
+
+
+def json_bytes(content: bytes) -> Response:
+    return Response(content=content, media_type="application/json")
 
 
 @app.get("/")
@@ -37,36 +106,40 @@ async def root():
     return {"message": "WhatTheFridge API is running"}
 
 
-@app.post("/api/ingredients")
-async def submit_ingredients(
-    request: Request,
-    image: Optional[UploadFile] = File(None)
-):
+@app.post("/api/ingredients", response_model=RecipeResponse)
+async def submit_ingredients(request: Request):
     """Submit ingredients and get recipe suggestions"""
     try:
-        # Parse form data
-        form = await request.form()
-        ingredients = form.getlist("ingredients")
-        craving = form.get("craving")
+        # Reject early instead of queueing work no search provider can serve
+        require_upstreams("youtube", "duckduckgo")
+        
+        # Parse form data as it streams in, so a bad or oversized image is refused on its first chunks
+        try:
+            form, image = await read_image_form(request, "image", MAX_UPLOAD_BYTES, FORM_OVERHEAD_BYTES)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.message)
+        ingredients = form.get("ingredients", [])
+        craving = (form.get("craving") or [None])[0]
+        include_transcripts = (form.get("include_transcripts") or [""])[0].lower() == "true"
         
         # Filter out empty ingredients
         ingredients = [ing for ing in ingredients if ing.strip()]
         
-        image_data = None
-        if image:
-            image_data = await image.read()
-            # Preprocess image if needed
-            from ..services.image_service import ImageService
-            image_service = ImageService()
-            if image_service.validate_image(image_data):
-                image_data = image_service.preprocess_image(image_data)
+        image_data, image_hash = image if image else (None, None)
         
-        # Process ingredients
-        result = agent_graph.process_ingredients_flow(
-            ingredients=ingredients,
-            craving=craving,
-            image_data=image_data
-        )
+        async with get_admission("ingredients").slot():
+            if image_data is not None and agent_graph.nodes.cached_recognition(image_hash) is None:
+                # Preprocess image if needed; an image seen before is recognized from cache instead
+                image_data = await run_in_threadpool(image_service.prepare_image, image_data)
+            
+            # Process ingredients off the event loop
+            result = await run_in_threadpool(
+                agent_graph.process_ingredients_flow,
+                ingredients=ingredients,
+                craving=craving,
+                image_data=image_data,
+                image_hash=image_hash
+            )
         
         # Check for errors in the result
         if result.get('error'):
@@ -76,24 +149,15 @@ async def submit_ingredients(
         conversation_id = str(uuid.uuid4())
         conversation_states[conversation_id] = result
         
-        # Convert recipes to response format
-        recipes = []
-        for recipe in result.get('recipes', []):
-            recipes.append(Recipe(
-                title=recipe.get('title', 'Unknown'),
-                source=recipe.get('source', 'unknown'),
-                url=recipe.get('url', ''),
-                thumbnail=recipe.get('thumbnail'),
-                description=recipe.get('description'),
-                video_id=recipe.get('video_id'),
-                transcript=recipe.get('transcript'),
-                steps=recipe.get('steps', [])
-            ))
+        # Encode recipes straight to the response body
+        recipes = encoded_recipes(conversation_id, result.get('recipes', []), include_transcripts)
         
-        return RecipeResponse(
-            recipes=recipes,
-            conversation_id=conversation_id
-        )
+        return json_bytes(encode_listing(
+            recipes,
+            conversation_id=conversation_id,
+            partial=result.get('partial', False),
+            skipped_stages=result.get('skipped_stages', [])
+        ))
     
     except HTTPException:
         raise
@@ -104,6 +168,58 @@ async def submit_ingredients(
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@app.post("/api/ingredients/batch")
+async def submit_ingredients_batch(batch: BatchIngredientsRequest):
+    """Submit many ingredient sets at once, streaming one JSON line per item as it finishes"""
+    max_items = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="No items in batch")
+    if len(batch.items) > max_items:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {max_items} items")
+    
+    require_upstreams("youtube", "duckduckgo")
+    admission = get_admission("batch")
+    # Take the slot before streaming starts so rejections are still proper 429/503 responses
+    await admission.acquire()
+    cancelled = threading.Event()
+    finished = threading.Lock()
+    
+    def finish():
+        # Called when the stream ends and again by the background task, which also
+        # runs if the client disconnects before the first line; only the first call counts
+        cancelled.set()
+        if finished.acquire(blocking=False):
+            admission.release()
+    
+    items = [{'ingredients': item.ingredients, 'craving': item.craving} for item in batch.items]
+    
+    def lines():
+        for index, result in agent_graph.process_batch_flow(items, cancelled=cancelled):
+            if result.get('error'):
+                yield BatchItemResponse(index=index, error=result['error']).model_dump_json().encode() + b"\n"
+                continue
+            conversation_id = str(uuid.uuid4())
+            conversation_states[conversation_id] = result
+            recipes = encoded_recipes(conversation_id, result.get('recipes', []))
+            yield encode_listing(
+                recipes,
+                index=index,
+                conversation_id=conversation_id,
+                partial=result.get('partial', False),
+                skipped_stages=result.get('skipped_stages', []),
+                error=None
+            ) + b"\n"
+    
+    async def stream():
+        try:
+            async for line in iterate_in_threadpool(lines()):
+                yield line
+        finally:
+            finish()
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=BackgroundTask(finish))
+
+
 @app.post("/api/chat")
 async def chat_with_agent(message: ChatMessage):
     """Chat with the cooking agent"""
@@ -115,7 +231,9 @@ async def chat_with_agent(message: ChatMessage):
         state = conversation_states[conversation_id]
         
         # Process chat
-        result = agent_graph.chat(message.message, state)
+        require_upstreams("gemini")
+        async with get_admission("chat").slot():
+            result = await run_in_threadpool(agent_graph.chat, message.message, state)
         conversation_states[conversation_id] = result
         
         # Extract response from conversation history
@@ -127,12 +245,15 @@ async def chat_with_agent(message: ChatMessage):
         
         # Check if recipes were updated
         updated_recipes = None
-        if result.get('selected_recipe') and result['selected_recipe'].get('customized'):
+        version = result.get('recipe_version')
+        if version:
             updated_recipes = [Recipe(
-                title=result['selected_recipe'].get('title', 'Customized Recipe'),
+                title=version.get('title', 'Customized Recipe'),
                 source='customized',
-                url='',
-                steps=[result['selected_recipe']['customized']]
+                url=version.get('url', ''),
+                description=f"Version {version['version']}: {version['changes'][-1]}" if version.get('changes') else None,
+                ingredients=version.get('ingredients') or None,
+                steps=version.get('steps', [])
             )]
         
         return ChatResponse(
@@ -153,40 +274,35 @@ async def get_transcript(video_id: str):
     try:
         from .services.youtube_service import YouTubeService
         youtube_service = YouTubeService()
-        transcript = youtube_service.get_transcript(video_id)
+        transcript = youtube_service.cached_transcript(video_id)
+        if transcript is None:
+            require_upstreams("youtube_transcripts")
+            async with get_admission("transcribe").slot():
+                transcript = await run_in_threadpool(youtube_service.get_transcript, video_id)
         
         if transcript:
             return {"transcript": transcript, "video_id": video_id}
         else:
             raise HTTPException(status_code=404, detail="Transcript not available")
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/recipes")
-async def get_recipes(conversation_id: str):
-    """Get recipes for a conversation"""
+async def get_recipes(conversation_id: str, include_transcripts: bool = False):
+    """Get recipes for a conversation; transcripts are left out unless asked for"""
     try:
-        if conversation_id not in conversation_states:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-        
-        state = conversation_states[conversation_id]
-        recipes = []
-        
-        for recipe in state.get('recipes', []):
-            recipes.append(Recipe(
-                title=recipe.get('title', 'Unknown'),
-                source=recipe.get('source', 'unknown'),
-                url=recipe.get('url', ''),
-                thumbnail=recipe.get('thumbnail'),
-                description=recipe.get('description'),
-                video_id=recipe.get('video_id'),
-                transcript=recipe.get('transcript'),
-                steps=recipe.get('steps', [])
-            ))
+        encoded = recipe_listings.get((conversation_id, include_transcripts))
+        if encoded is None:
+            state = conversation_states.get(conversation_id)
+            if state is None:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+            encoded = encoded_recipes(conversation_id, state.get('recipes', []), include_transcripts)
         
-        return {"recipes": recipes}
+        return json_bytes(encode_listing(encoded))
     
     except HTTPException:
         raise
@@ -195,6 +311,6 @@ async def get_recipes(conversation_id: str):
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from .__main__ import main
+    main()
 
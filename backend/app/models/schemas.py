@@ -22,12 +22,30 @@ class Recipe(BaseModel):
     description: Optional[str] = None
     video_id: Optional[str] = None
     transcript: Optional[str] = None
+    ingredients: Optional[List[str]] = None
     steps: Optional[List[str]] = None
+    enriched: bool = False
+    has_transcript: bool = False
 
 
 class RecipeResponse(BaseModel):
     recipes: List[Recipe]
     conversation_id: str
+    partial: bool = False
+    skipped_stages: List[str] = []
+
+
+class BatchIngredientsRequest(BaseModel):
+    items: List[IngredientInput]
+
+
+class BatchItemResponse(BaseModel):
+    index: int
+    conversation_id: Optional[str] = None
+    recipes: List[Recipe] = []
+    partial: bool = False
+    skipped_stages: List[str] = []
+    error: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
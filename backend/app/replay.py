@@ -0,0 +1,156 @@
+"""Rerun a captured flow offline and profile it.
+
+    python -m app.replay captures/20260101-120000-ingredients-ab12cd34.jsonl.gz
+    python -m app.replay ARCHIVE --profiler sampling --output stacks.txt
+    python -m app.replay ARCHIVE --profiler cprofile --output replay.prof --repeat 20
+
+Upstream calls are answered from the archive, and the caches start out holding
+what the recorded run found cached, so no network access or real Gemini key
+is needed. cProfile stats can be opened with snakeviz or pstats;
+sampling output is in collapsed-stack format for flamegraph.pl or speedscope.
+"""
+import argparse
+import cProfile
+import collections
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+def _prepare_environment() -> None:
+    # Replays must be deterministic and must not record themselves
+    os.environ.pop("CAPTURE_DIR", None)
+    os.environ.setdefault("GEMINI_API_KEY", "replay")
+    os.environ["CACHE_BACKEND"] = "memory"
+    os.environ["PREFETCH_ENABLED"] = "false"
+    os.environ["REQUEST_BUDGET_SECONDS"] = "0"
+    os.environ.setdefault("GEMINI_RPM", "1000000")
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads at a fixed interval"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def top(self, limit: int) -> str:
+        """Functions by share of samples in which they were on the stack"""
+        total = sum(self.samples.values()) or 1
+        inclusive = collections.Counter()
+        for stack, count in self.samples.items():
+            for frame in set(stack.split(';')):
+                inclusive[frame] += count
+        return '\n'.join(f"{100 * count / total:6.1f}%  {frame}" for frame, count in inclusive.most_common(limit))
+
+
+def run_flow(graph, recording) -> dict:
+    inputs = recording.inputs
+    if recording.flow == 'ingredients':
+        return graph.process_ingredients_flow(
+            ingredients=inputs.get('ingredients') or [],
+            craving=inputs.get('craving'),
+            image_data=inputs.get('image_data'),
+            budget_seconds=0,
+            image_hash=inputs.get('image_hash')
+        )
+    if recording.flow == 'chat':
+        return graph.chat(inputs['message'], inputs['state'])
+    raise ValueError(f"Unknown flow: {recording.flow}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.replay", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archive", help="Capture archive (.jsonl.gz) written with CAPTURE_DIR set")
+    parser.add_argument("--profiler", choices=["cprofile", "sampling", "none"], default="cprofile")
+    parser.add_argument("--repeat", type=int, default=1, help="Run the flow this many times")
+    parser.add_argument("--output", help="Write cProfile stats or collapsed stacks to this file")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key (default: cumulative)")
+    parser.add_argument("--limit", type=int, default=30, help="Rows of profile output to print")
+    args = parser.parse_args()
+
+    _prepare_environment()
+    from .agent.graph import CookingAgentGraph
+    from .services import capture
+    from .services.cache_service import clear_caches, get_cache
+
+    graph = CookingAgentGraph()
+    profiler = cProfile.Profile() if args.profiler == "cprofile" else None
+    sampler = SamplingProfiler() if args.profiler == "sampling" else None
+
+    recorded = capture.CaptureSession.load(args.archive)
+    recorded_time = sum(e['duration'] for e in recorded.events if e['type'] == 'upstream')
+    print(f"Replaying {recorded.flow} flow ({len(recorded.events)} events, "
+          f"{recorded_time:.2f}s spent upstream when recorded)")
+
+    durations = []
+    if sampler:
+        sampler.start()
+    for _ in range(args.repeat):
+        clear_caches()
+        recording = capture.CaptureSession.load(args.archive)
+        for name, key, value in recording.cached_entries():
+            get_cache(name).set(key, value)
+        started = time.perf_counter()
+        with capture.replaying(recording):
+            if profiler:
+                profiler.enable()
+            result = run_flow(graph, recording)
+            if profiler:
+                profiler.disable()
+        durations.append(time.perf_counter() - started)
+    if sampler:
+        sampler.stop()
+
+    print(f"Runs: {len(durations)}, best {min(durations) * 1000:.1f} ms, "
+          f"mean {sum(durations) / len(durations) * 1000:.1f} ms")
+    if result.get('error'):
+        print(f"Flow reported an error: {result['error']}")
+
+    if profiler:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats(args.sort).print_stats(args.limit)
+        print(stream.getvalue())
+        if args.output:
+            profiler.dump_stats(args.output)
+            print(f"Wrote cProfile stats to {args.output}")
+    if sampler:
+        print(sampler.top(args.limit))
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(sampler.collapsed() + '\n')
+            print(f"Wrote collapsed stacks to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Tuple, Type
+
+import requests
+from fastapi import HTTPException
+
+# How a call that ran out of time shows up, depending on the client library
+TIMEOUT_ERRORS = (TimeoutError, requests.Timeout)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling an upstream that is failing or saturated"""
+
+    def __init__(self, name: str, reason: str, retry_after: float):
+        super().__init__(f"{name} unavailable: {reason}")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class AdmissionRejected(HTTPException):
+    """HTTP 429/503 with a Retry-After header, raised before any expensive work starts"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+def _env(name: str, key: str, default: str) -> str:
+    return os.getenv(f"{name.upper()}_{key}", default)
+
+
+class CircuitBreaker:
+    """Stops calling a provider after repeated failures, probing again once reset_timeout passes"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        """Return True if a call may go through; lets a single probe through once half-open"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def cancel_probe(self) -> None:
+        """Give back a half-open probe that never reached the provider"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class UpstreamGuard:
+    """Concurrency limit, bounded wait queue and circuit breaker for one upstream provider.
+
+    Settings are read from <NAME>_CONCURRENCY, <NAME>_MAX_WAITING,
+    <NAME>_QUEUE_TIMEOUT, <NAME>_FAILURE_THRESHOLD, <NAME>_RESET_TIMEOUT and
+    <NAME>_SLOW_SECONDS.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.max_concurrency = int(_env(name, "CONCURRENCY", "8"))
+        self.max_waiting = int(_env(name, "MAX_WAITING", "16"))
+        self.queue_timeout = float(_env(name, "QUEUE_TIMEOUT", "2"))
+        # A healthy provider answers within this; timing out with less time than that proves nothing
+        self.slow_seconds = float(_env(name, "SLOW_SECONDS", "1.5"))
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(_env(name, "FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(_env(name, "RESET_TIMEOUT", "30")),
+        )
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def call(self, ignore: Tuple[Type[BaseException], ...] = (), timeout: Optional[float] = None,
+             neutral: Tuple[Type[BaseException], ...] = ()):
+        """Hold a slot for one upstream call; exceptions other than `ignore` count as failures.
+
+        Exceptions in `neutral` count neither way, for errors that belong to one
+        resource behind the provider rather than to the provider itself.
+        A timeout is only counted when the call was given at least slow_seconds;
+        a shorter one was cut by the request's own budget and says nothing about
+        the provider.
+        """
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(self.name, "circuit open", self.breaker.retry_after())
+        with self._lock:
+            if self._waiting >= self.max_waiting:
+                self.breaker.cancel_probe()
+                raise UpstreamUnavailable(self.name, "too many waiting calls", self.queue_timeout)
+            self._waiting += 1
+        try:
+            acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            self.breaker.cancel_probe()
+            raise UpstreamUnavailable(self.name, "timed out waiting for a slot", self.queue_timeout)
+        try:
+            yield
+        except ignore:
+            self.breaker.record_success()
+            raise
+        except neutral:
+            self.breaker.cancel_probe()
+            raise
+        except Exception as e:
+            if timeout is not None and timeout < self.slow_seconds and isinstance(e, TIMEOUT_ERRORS):
+                self.breaker.cancel_probe()
+            else:
+                self.breaker.record_failure()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            self._semaphore.release()
+
+
+class AdmissionController:
+    """Bounds in-flight requests on an endpoint and sheds load once the wait queue is full.
+
+    Settings are read from ADMISSION_<NAME>_MAX_IN_FLIGHT, ADMISSION_<NAME>_MAX_QUEUE
+    and ADMISSION_<NAME>_QUEUE_TIMEOUT.
+    """
+
+    def __init__(self, name: str):
+        prefix = f"ADMISSION_{name}"
+        self.name = name
+        self.max_in_flight = int(_env(prefix, "MAX_IN_FLIGHT", "16"))
+        self.max_queue = int(_env(prefix, "MAX_QUEUE", "32"))
+        self.queue_timeout = float(_env(prefix, "QUEUE_TIMEOUT", "5"))
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._waiting = 0
+
+    async def acquire(self) -> None:
+        """Wait for a slot, raising AdmissionRejected if the queue is full or the wait times out"""
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            raise AdmissionRejected(429, "Too many requests, please retry shortly", self.queue_timeout)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise AdmissionRejected(503, "Server is busy, please retry shortly", self.queue_timeout)
+        finally:
+            self._waiting -= 1
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_guards: Dict[str, UpstreamGuard] = {}
+_admission: Dict[str, AdmissionController] = {}
+_registry_lock = threading.Lock()
+
+
+def get_guard(name: str) -> UpstreamGuard:
+    """Return the process-wide guard for an upstream provider"""
+    with _registry_lock:
+        if name not in _guards:
+            _guards[name] = UpstreamGuard(name)
+        return _guards[name]
+
+
+def get_admission(name: str) -> AdmissionController:
+    """Return the process-wide admission controller for an endpoint"""
+    with _registry_lock:
+        if name not in _admission:
+            _admission[name] = AdmissionController(name)
+        return _admission[name]
+
+
+def require_upstreams(*names: str) -> None:
+    """Fail fast with 503 when every one of the named upstreams has an open circuit"""
+    breakers = [get_guard(name).breaker for name in names]
+    if breakers and all(breaker.is_open for breaker in breakers):
+        retry_after = min(breaker.retry_after() for breaker in breakers)
+        raise AdmissionRejected(503, f"Upstream unavailable: {', '.join(names)}", retry_after)
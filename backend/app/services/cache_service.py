@@ -0,0 +1,355 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from . import capture
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into a single execution"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            result = fn()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache with per-entry expiry"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        # Called on a miss with the key; returns (value, seconds left or None) to restore, or None
+        self.fallback: Optional[Callable[[Hashable], Optional[tuple]]] = None
+        # Registry name, set by get_cache; hits on named caches are recorded while capturing
+        self.name: Optional[str] = None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at >= time.monotonic():
+                    self._data.move_to_end(key)
+                    return self._hit(key, value)
+                del self._data[key]
+        return self._restore(key, default)
+
+    def _hit(self, key: Hashable, value: Any) -> Any:
+        if self.name is not None and capture.is_active():
+            capture.cache_hit(self.name, key, value)
+        return value
+
+    def _restore(self, key: Hashable, default: Any) -> Any:
+        fallback = self.fallback
+        if fallback is None:
+            return default
+        restored = fallback(key)
+        if restored is None:
+            return default
+        value, ttl = restored
+        self.set(key, value, ttl)
+        return self._hit(key, value)
+
+    def items(self) -> List[Tuple[Hashable, Any, Optional[float]]]:
+        """Live entries as (key, value, seconds left or None)"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value, None if expires_at is None else expires_at - now)
+                    for key, (value, expires_at) in self._data.items()
+                    if expires_at is None or expires_at >= now]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store value under key, evicting the least recently used entry if full"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        if self.name is not None and capture.is_active():
+            capture.cache_stored(self.name, key)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def incr(self, key: Hashable, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add amount to the counter under key (missing or expired counts as 0) and return the new value"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        if self.name is not None and capture.is_active():
+            capture.cache_stored(self.name, key)
+        with self._lock:
+            entry = self._data.get(key)
+            count = entry[0] if entry is not None and (entry[1] is None or entry[1] >= now) else 0
+            count += amount
+            self._data[key] = (count, now + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return count
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Return the cached value, computing it at most once across concurrent callers.
+
+        Falsy results (no transcript, no search hits) are returned but not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        def load():
+            # Another caller may have stored it while we waited to lead
+            value = self.get(key)
+            if value is None:
+                value = compute()
+                if value:
+                    self.set(key, value, ttl)
+            return value
+
+        return self._flights.do(key, load)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+        self.fallback = None
+
+    def __contains__(self, key: Hashable) -> bool:
+        marker = object()
+        return self.get(key, marker) is not marker
+
+    def __getitem__(self, key: Hashable) -> Any:
+        marker = object()
+        value = self.get(key, marker)
+        if value is marker:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.set(key, value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache(TTLCache):
+    """Cache stored in a shared SQLite database so several worker processes see the same entries.
+
+    The database runs in WAL mode, so readers in one process never block on a
+    writer in another. Keys must be JSON-serializable; values are pickled.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, namespace: str, maxsize: int = 1024, ttl: Optional[float] = 3600):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._flights = SingleFlight()
+        self.fallback = None
+        self.name: Optional[str] = None
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+            " expires_at REAL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_updated ON cache (namespace, updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # Connections are per thread and per process; a forked worker opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return json.dumps(key)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, self._key(key)),
+        ).fetchone()
+        if row is None:
+            return self._restore(key, default)
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return self._restore(key, default)
+        return self._hit(key, pickle.loads(value))
+
+    def items(self) -> List[Tuple[Hashable, Any, Optional[float]]]:
+        now = time.time()
+        rows = self._conn().execute(
+            "SELECT key, value, expires_at FROM cache WHERE namespace = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (self.namespace, now),
+        ).fetchall()
+        return [(json.loads(key), pickle.loads(value), None if expires_at is None else expires_at - now)
+                for key, value, expires_at in rows]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        if self.name is not None and capture.is_active():
+            capture.cache_stored(self.name, key)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, self._key(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at, now),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def incr(self, key: Hashable, amount: int = 1, ttl: Optional[float] = None) -> int:
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        if self.name is not None and capture.is_active():
+            capture.cache_stored(self.name, key)
+        conn = self._conn()
+        # Read and write in one write transaction so concurrent workers do not lose increments
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, self._key(key)),
+            ).fetchone()
+            count = pickle.loads(row[0]) if row and (row[1] is None or row[1] >= now) else 0
+            count += amount
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, self._key(key), pickle.dumps(count, protocol=pickle.HIGHEST_PROTOCOL),
+                 now + ttl if ttl else None, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def prune(self) -> None:
+        """Drop expired entries and the oldest ones beyond maxsize"""
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at < ?",
+            (self.namespace, time.time()),
+        )
+        conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key NOT IN ("
+            " SELECT key FROM cache WHERE namespace = ? ORDER BY updated_at DESC LIMIT ?)",
+            (self.namespace, self.namespace, self.maxsize),
+        )
+
+    def delete(self, key: Hashable) -> None:
+        self._conn().execute(
+            "DELETE FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, self._key(key)),
+        )
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+        self.fallback = None
+
+    def __len__(self) -> int:
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        return row[0]
+
+
+_caches: Dict[str, TTLCache] = {}
+_caches_lock = threading.Lock()
+# Gives each cache its fallback by name, e.g. lookups in a startup snapshot
+_fallback_source: Optional[Callable[[str], Optional[Callable]]] = None
+
+
+def get_cache(name: str, maxsize: int = 1024, ttl: Optional[float] = 3600) -> TTLCache:
+    """Return the cache registered under name, creating it on first use.
+
+    Size and TTL can be overridden with <NAME>_CACHE_SIZE and <NAME>_CACHE_TTL.
+    With CACHE_BACKEND=sqlite the cache lives in the database at CACHE_PATH and
+    is shared by every worker process; otherwise it is private to this process.
+    """
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            prefix = name.upper()
+            maxsize = int(os.getenv(f"{prefix}_CACHE_SIZE", maxsize))
+            ttl_env = os.getenv(f"{prefix}_CACHE_TTL")
+            if ttl_env is not None:
+                ttl = float(ttl_env)
+            if os.getenv("CACHE_BACKEND", "memory").lower() == "sqlite":
+                path = os.getenv("CACHE_PATH", ".cache/whatthefridge.db")
+                cache = SQLiteCache(path, name, maxsize=maxsize, ttl=ttl)
+            else:
+                cache = TTLCache(maxsize=maxsize, ttl=ttl)
+            cache.name = name
+            if _fallback_source is not None:
+                cache.fallback = _fallback_source(name)
+            _caches[name] = cache
+        return cache
+
+
+def clear_caches() -> None:
+    """Empty every registered cache"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.clear()
+
+
+def registered_caches() -> Dict[str, TTLCache]:
+    with _caches_lock:
+        return dict(_caches)
+
+
+def restore_from(source: Callable[[str], Optional[Callable]]) -> None:
+    """Fill misses in every cache, present and future, from source(name)"""
+    global _fallback_source
+    with _caches_lock:
+        _fallback_source = source
+        for name, cache in _caches.items():
+            cache.fallback = source(name)
@@ -0,0 +1,176 @@
+"""Carry warm caches over to new processes through a snapshot file.
+
+With CACHE_SNAPSHOT set, the API writes its caches to that file on shutdown
+(and every CACHE_SNAPSHOT_INTERVAL seconds if set), and a starting process
+opens it before serving. The file holds the pickled values back to back,
+followed by an index of (cache, key) -> (offset, length, expiry). Opening it
+maps the file and reads only the index; a value is unpickled the first time
+its cache misses on that key, and is then served from the cache as usual.
+Entries that were never looked up are carried into the next snapshot as they are.
+"""
+import json
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional
+
+from .cache_service import TTLCache, registered_caches, restore_from
+
+MAGIC = b'WTFSNAP1'
+# Magic, index offset, index length
+HEADER = struct.Struct('<8sQQ')
+# Per-conversation and short-lived failure state are not worth carrying over
+EXCLUDED_CACHES = {'conversations', 'recipe_listings', 'host_failures'}
+# The snapshot this process started from, whose unrestored entries later dumps keep
+_loaded: Optional["Snapshot"] = None
+
+
+def snapshot_path() -> Optional[str]:
+    return os.getenv("CACHE_SNAPSHOT") or None
+
+
+def dump(path: str, caches: Dict[str, TTLCache], previous: Optional["Snapshot"] = None) -> int:
+    """Write the live entries of caches to path, replacing it atomically; returns the entry count.
+
+    Entries of the previous snapshot that were never restored are kept, unless
+    the cache now holds the same key.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    index: Dict[str, Dict[str, tuple]] = {}
+    count = 0
+    now = time.time()
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        for name, cache in caches.items():
+            entries = index[name] = {}
+            for key, value, ttl in cache.items():
+                try:
+                    key_text = json.dumps(key)
+                    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    continue
+                entries[key_text] = (f.tell(), len(blob), None if ttl is None else now + ttl)
+                f.write(blob)
+                count += 1
+        if previous is not None:
+            for name in previous.names():
+                entries = index.setdefault(name, {})
+                for key_text, blob, expires_at in previous.unconsumed(name):
+                    if key_text in entries:
+                        continue
+                    entries[key_text] = (f.tell(), len(blob), expires_at)
+                    f.write(blob)
+                    count += 1
+        index_offset = f.tell()
+        index_blob = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+        f.write(index_blob)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, index_offset, len(index_blob)))
+    os.replace(tmp_path, path)
+    return count
+
+
+class Snapshot:
+    """A memory-mapped snapshot; each entry is handed out at most once"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, offset, length = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a cache snapshot")
+        self._index: Dict[str, Dict[str, tuple]] = pickle.loads(self._map[offset:offset + length])
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._index.values())
+
+    def lookup(self, name: str) -> Optional[Callable[[Hashable], Optional[tuple]]]:
+        """Fallback for the named cache, or None if the snapshot has nothing for it"""
+        entries = self._index.get(name)
+        if not entries:
+            return None
+
+        def restore(key: Hashable) -> Optional[tuple]:
+            try:
+                key_text = json.dumps(key)
+            except TypeError:
+                return None
+            # Taken out of the index so a later delete or eviction is not undone
+            with self._lock:
+                entry = entries.pop(key_text, None)
+            if entry is None:
+                return None
+            offset, length, expires_at = entry
+            ttl = None
+            if expires_at is not None:
+                ttl = expires_at - time.time()
+                if ttl <= 0:
+                    return None
+            return self._load(offset, length), ttl
+
+        return restore
+
+    def names(self) -> List[str]:
+        return list(self._index)
+
+    def unconsumed(self, name: str) -> Iterator[tuple]:
+        """(key, pickled value, expiry) of the unexpired entries of a cache not restored yet"""
+        with self._lock:
+            entries = list(self._index.get(name, {}).items())
+        now = time.time()
+        for key_text, (offset, length, expires_at) in entries:
+            if expires_at is None or expires_at > now:
+                yield key_text, self._map[offset:offset + length], expires_at
+
+    def _load(self, offset: int, length: int) -> Any:
+        return pickle.loads(self._map[offset:offset + length])
+
+
+def save_snapshot(path: Optional[str] = None) -> Optional[int]:
+    """Dump the registered caches to CACHE_SNAPSHOT (or path)"""
+    path = path or snapshot_path()
+    if not path:
+        return None
+    caches = {name: cache for name, cache in registered_caches().items() if name not in EXCLUDED_CACHES}
+    try:
+        count = dump(path, caches, _loaded)
+        print(f"Saved {count} cache entries to {path}")
+        return count
+    except Exception as e:
+        print(f"Error saving cache snapshot: {str(e)}")
+        return None
+
+
+def load_snapshot(path: Optional[str] = None) -> Optional[Snapshot]:
+    """Serve cache misses from the snapshot at CACHE_SNAPSHOT (or path), if there is one"""
+    path = path or snapshot_path()
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except Exception as e:
+        print(f"Error loading cache snapshot: {str(e)}")
+        return None
+    global _loaded
+    _loaded = snapshot
+    restore_from(snapshot.lookup)
+    print(f"Restoring up to {len(snapshot)} cache entries from {path}")
+    return snapshot
+
+
+def start_periodic_snapshots(interval: float, path: Optional[str] = None) -> threading.Event:
+    """Save a snapshot every interval seconds until the returned event is set"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            save_snapshot(path)
+
+    threading.Thread(target=run, name="cache-snapshot", daemon=True).start()
+    return stop
@@ -0,0 +1,222 @@
+"""Opt-in recording of agent graph runs for offline replay and profiling.
+
+With CAPTURE_DIR set, each ingredient or chat flow is written to a gzipped
+JSON-lines archive holding the flow inputs, every node's input and output,
+and the raw upstream responses (YouTube and DuckDuckGo HTML, recipe pages,
+transcripts, Gemini text). Values the flow found already cached are recorded
+too, so a run in a warm process replays like one in a cold process.
+`python -m app.replay <archive>` reruns the flow against the archive without
+network access.
+"""
+import base64
+import contextvars
+import functools
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class UpstreamNotRecorded(Exception):
+    """Raised during replay when the archive has no response for an upstream call"""
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(bytes(obj)).decode('ascii')}
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    return repr(obj)
+
+
+def _object_hook(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1 and '__bytes__' in obj:
+        return base64.b64decode(obj['__bytes__'])
+    return obj
+
+
+def _hashable(value: Any) -> Any:
+    """Turn the lists a JSON round trip makes of tuple keys back into tuples"""
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+def _snapshot(value: Any) -> Any:
+    """JSON-safe copy of value, taken now so later in-place mutation does not leak in"""
+    return json.loads(json.dumps(value, default=_default))
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable key for upstream calls whose natural key is large (prompts, images)"""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        elif not isinstance(part, (bytes, bytearray)):
+            part = json.dumps(part, default=_default, sort_keys=True).encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CaptureSession:
+    """Events for one flow run, either being recorded or being replayed"""
+
+    def __init__(self, flow: str, inputs: Dict[str, Any], events: Optional[List[dict]] = None,
+                 replaying: bool = False):
+        self.flow = flow
+        self.inputs = inputs
+        self.events: List[dict] = events if events is not None else []
+        self.replaying = replaying
+        self._responses: Dict[tuple, List[Any]] = {}
+        # (cache, key) pairs already recorded or stored during this run
+        self._cache_keys: set = set()
+        self._cache_lock = threading.Lock()
+        if replaying:
+            for event in self.events:
+                if event['type'] == 'upstream':
+                    self._responses.setdefault((event['kind'], event['key']), []).append(event['value'])
+
+    def record_upstream(self, kind: str, key: str, value: Any, duration: float) -> None:
+        self.events.append({'type': 'upstream', 'kind': kind, 'key': key,
+                            'value': _snapshot(value), 'duration': duration})
+
+    def record_cache_hit(self, cache: str, key: Any, value: Any) -> None:
+        """Record the first read of a cache entry the run did not store itself"""
+        marker = (cache, json.dumps(key, default=_default))
+        with self._cache_lock:
+            if marker in self._cache_keys:
+                return
+            self._cache_keys.add(marker)
+        self.events.append({'type': 'cache', 'cache': cache, 'key': _snapshot(key), 'value': _snapshot(value)})
+
+    def record_cache_store(self, cache: str, key: Any) -> None:
+        with self._cache_lock:
+            self._cache_keys.add((cache, json.dumps(key, default=_default)))
+
+    def cached_entries(self) -> Iterator[tuple]:
+        """(cache, key, value) for every cache hit recorded, keys made hashable again"""
+        for event in self.events:
+            if event['type'] == 'cache':
+                yield event['cache'], _hashable(event['key']), event['value']
+
+    def record_node(self, node: str, state: Any, output: Any, duration: float) -> None:
+        self.events.append({'type': 'node', 'node': node, 'input': state,
+                            'output': _snapshot(output), 'duration': duration})
+
+    def replay_upstream(self, kind: str, key: str) -> Any:
+        responses = self._responses.get((kind, key))
+        if not responses:
+            raise UpstreamNotRecorded(f"No recorded {kind} response for {key}")
+        # Repeated calls get the recorded responses in order, then the last one again
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    def save(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.flow}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        path = os.path.join(directory, name)
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            header = {'type': 'flow', 'flow': self.flow, 'inputs': self.inputs, 'recorded_at': time.time()}
+            f.write(json.dumps(header, default=_default) + '\n')
+            for event in self.events:
+                f.write(json.dumps(event, default=_default) + '\n')
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "CaptureSession":
+        """Open an archive for replay"""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            lines = [json.loads(line, object_hook=_object_hook) for line in f if line.strip()]
+        header, events = lines[0], lines[1:]
+        return cls(header['flow'], header['inputs'], events, replaying=True)
+
+
+_active: contextvars.ContextVar = contextvars.ContextVar('capture_session', default=None)
+
+
+def is_active() -> bool:
+    return _active.get() is not None
+
+
+def capture_dir() -> Optional[str]:
+    return os.getenv("CAPTURE_DIR") or None
+
+
+@contextmanager
+def session(flow: str, inputs: Dict[str, Any]) -> Iterator[Optional[CaptureSession]]:
+    """Record the enclosed flow run if capture is enabled (sampled by CAPTURE_SAMPLE_RATE)"""
+    current = _active.get()
+    directory = capture_dir()
+    if current is not None or not directory or random.random() >= float(os.getenv("CAPTURE_SAMPLE_RATE", "1")):
+        # Already inside a recording or a replay, or capture is off
+        yield current
+        return
+    recording = CaptureSession(flow, _snapshot(inputs))
+    token = _active.set(recording)
+    try:
+        yield recording
+    finally:
+        _active.reset(token)
+        try:
+            path = recording.save(directory)
+            print(f"Captured {flow} flow to {path}")
+        except Exception as e:
+            print(f"Error saving capture: {str(e)}")
+
+
+@contextmanager
+def replaying(recording: CaptureSession) -> Iterator[CaptureSession]:
+    """Serve upstream calls from a loaded archive instead of the network"""
+    token = _active.set(recording)
+    try:
+        yield recording
+    finally:
+        _active.reset(token)
+
+
+def upstream(kind: str, key: str, fetch: Callable[[], Any]) -> Any:
+    """Fetch a raw upstream response, recording it or serving it from a replay archive"""
+    current = _active.get()
+    if current is not None and current.replaying:
+        return current.replay_upstream(kind, key)
+    started = time.perf_counter()
+    value = fetch()
+    if current is not None:
+        current.record_upstream(kind, key, value, time.perf_counter() - started)
+    return value
+
+
+def cache_hit(cache: str, key: Any, value: Any) -> None:
+    """Note a cache entry the flow read, so replays can start with it cached"""
+    current = _active.get()
+    if current is not None and not current.replaying:
+        current.record_cache_hit(cache, key, value)
+
+
+def cache_stored(cache: str, key: Any) -> None:
+    """Note a cache entry the flow wrote itself; later reads of it are not recorded"""
+    current = _active.get()
+    if current is not None and not current.replaying:
+        current.record_cache_store(cache, key)
+
+
+def traced(name: str, node: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """Wrap a graph node so its input and output are recorded while capturing"""
+    @functools.wraps(node)
+    def wrapper(state):
+        current = _active.get()
+        if current is None or current.replaying:
+            return node(state)
+        state_in = _snapshot(state)
+        started = time.perf_counter()
+        output = node(state)
+        current.record_node(name, state_in, output, time.perf_counter() - started)
+        return output
+    return wrapper
@@ -0,0 +1,242 @@
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+from .admission import get_guard
+
+# Lower numbers run first
+PRIORITY_CHAT = 0
+PRIORITY_VISION = 1
+PRIORITY_CUSTOMIZE = 2
+PRIORITY_BACKGROUND = 5
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count for quota accounting (about four characters per token)"""
+    return sum(len(text) for text in texts if isinstance(text, str)) // 4 + 1
+
+
+class QuotaExceeded(Exception):
+    """A Gemini call refused for quota; the provider is up, so the breaker does not count it"""
+
+
+def is_quota_error(error: Exception) -> bool:
+    if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        return True
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'rate limit' in message
+
+
+class TokenBucket:
+    """Rate limiter refilled continuously at `per_minute` units per minute"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` units now and return how many seconds to wait before using them.
+
+        The bucket may go into debt, so callers that reserve later queue up behind
+        earlier reservations instead of overtaking them.
+        """
+        level = self._take(min(amount, self.capacity))
+        return 0.0 if level >= 0 else -level / self.rate
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available, without taking them"""
+        level = self._take(0) - min(amount, self.capacity)
+        return 0.0 if level >= 0 else -level / self.rate
+
+    def _take(self, amount: float) -> float:
+        """Refill, take `amount` and return the level left"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return self.tokens
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket kept in the SQLite database at `path`, so every worker process draws on the same quota"""
+
+    def __init__(self, path: str, name: str, per_minute: float, capacity: Optional[float] = None):
+        super().__init__(per_minute, capacity)
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # Connections are per thread and per process; a forked worker opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _take(self, amount: float) -> float:
+        conn = self._conn()
+        # Wall-clock time, since monotonic clocks are not comparable across processes
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE name = ?", (self.name,)).fetchone()
+            tokens, updated = row if row else (self.capacity, now)
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate) - amount
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (name, tokens, updated) VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return tokens
+
+
+def make_bucket(name: str, per_minute: float) -> TokenBucket:
+    """A bucket shared by all worker processes with CACHE_BACKEND=sqlite, otherwise private to this one"""
+    if os.getenv("CACHE_BACKEND", "memory").lower() == "sqlite":
+        path = os.getenv("CACHE_PATH", ".cache/whatthefridge.db")
+        return SharedTokenBucket(path, name, per_minute)
+    return TokenBucket(per_minute)
+
+
+class _Job:
+    def __init__(self, priority: int, run: Callable[[], Any], tokens: int):
+        self.priority = priority
+        self.run = run
+        self.tokens = tokens
+        self.future: Future = Future()
+
+
+class GeminiScheduler:
+    """Shared queue in front of Gemini that keeps calls within the account's quota.
+
+    Calls are dispatched by priority (chat before vision, customization and
+    background step extraction) through RPM and TPM token buckets, and quota
+    errors are retried with exponential backoff. With CACHE_BACKEND=sqlite the
+    buckets live in the shared database, so the quota holds across workers.
+    """
+
+    def __init__(self):
+        self.requests_bucket = make_bucket("gemini_rpm", float(os.getenv("GEMINI_RPM", "15")))
+        self.tokens_bucket = make_bucket("gemini_tpm", float(os.getenv("GEMINI_TPM", "1000000")))
+        self.workers = int(os.getenv("GEMINI_WORKERS", "4"))
+        self.max_retries = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+        self.backoff = float(os.getenv("GEMINI_RETRY_BACKOFF", "1"))
+        self.guard = get_guard("gemini")
+        self._heap: list = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        # One worker at a time waits for quota and then takes the most urgent job
+        self._dispatch_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def submit(self, run: Callable[[], Any], priority: int = PRIORITY_BACKGROUND, tokens: int = 1) -> Future:
+        """Queue a Gemini call"""
+        self._ensure_started()
+        job = _Job(priority, run, tokens)
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._counter), job))
+            self._cond.notify()
+        return job.future
+
+    def call(self, run: Callable[[], Any], priority: int = PRIORITY_BACKGROUND, tokens: int = 1,
+             timeout: Optional[float] = None) -> Any:
+        """Submit a call and wait for its result, cancelling it if still queued after timeout"""
+        future = self.submit(run, priority, tokens)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Gemini call timed out after {timeout:.1f}s")
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"gemini-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _next_job(self) -> _Job:
+        with self._cond:
+            while not self._heap:
+                self._cond.wait()
+            _, _, job = heapq.heappop(self._heap)
+            return job
+
+    def _run(self) -> None:
+        while True:
+            with self._dispatch_lock:
+                # Wait for a request slot before popping, so a chat queued meanwhile
+                # is not stuck behind a background job sleeping off the quota
+                delay = self.requests_bucket.wait_time(1)
+                while delay > 0:
+                    time.sleep(delay)
+                    delay = self.requests_bucket.wait_time(1)
+                job = self._next_job()
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                delay = max(self.requests_bucket.reserve(1), self.tokens_bucket.reserve(job.tokens))
+            time.sleep(delay)
+            try:
+                job.future.set_result(self._with_retry(job.run))
+            except Exception as e:
+                job.future.set_exception(e)
+
+    def _with_retry(self, fn: Callable[[], Any]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.guard.call(ignore=(QuotaExceeded,)):
+                    try:
+                        return fn()
+                    except Exception as e:
+                        if is_quota_error(e):
+                            raise QuotaExceeded(str(e)) from e
+                        raise
+            except QuotaExceeded:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+                print(f"Gemini quota exceeded, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                # The retry is another request against the quota
+                time.sleep(self.requests_bucket.reserve(1))
+
+
+_scheduler: Optional[GeminiScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> GeminiScheduler:
+    """Return the process-wide scheduler shared by every GeminiService"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GeminiScheduler()
+        return _scheduler
@@ -1,9 +1,19 @@
 import os
 import google.generativeai as genai
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 import base64
 from PIL import Image
 import io
+import re
+
+from . import capture
+from .gemini_scheduler import (
+    get_scheduler, estimate_tokens, PRIORITY_CHAT, PRIORITY_VISION,
+    PRIORITY_CUSTOMIZE, PRIORITY_BACKGROUND
+)
+
+# Headroom for the model's answer when accounting tokens against the TPM quota
+RESPONSE_TOKENS = 512
 
 
 class GeminiService:
@@ -16,6 +26,15 @@ class GeminiService:
         # gemini-1.5-pro is also available but has rate limits
         self.model = genai.GenerativeModel('gemini-1.5-flash')
         self.vision_model = genai.GenerativeModel('gemini-1.5-flash')  # Same model supports vision
+        # All calls go through one process-wide scheduler so they share the quota
+        self.scheduler = get_scheduler()
+
+    def _generate(self, kind: str, key_parts: tuple, run, **schedule) -> str:
+        """Run a Gemini call through the scheduler and return its text (recorded when capturing)"""
+        return capture.upstream(
+            f'gemini_{kind}', capture.fingerprint(*key_parts),
+            lambda: self.scheduler.call(lambda: run().text, **schedule)
+        )
 
     def chat(self, message: str, conversation_history: Optional[List[dict]] = None) -> str:
         """Send a chat message to Gemini and get response"""
@@ -29,15 +48,26 @@ class GeminiService:
                         formatted_history.append(msg)
                 
                 if formatted_history:
-                    chat = self.model.start_chat(history=formatted_history)
-                    response = chat.send_message(message)
+                    def run():
+                        chat = self.model.start_chat(history=formatted_history)
+                        return chat.send_message(message)
                 else:
-                    response = self.model.generate_content(message)
+                    def run():
+                        return self.model.generate_content(message)
             else:
-                response = self.model.generate_content(message)
+                formatted_history = []
+                def run():
+                    return self.model.generate_content(message)
             
-            if response and hasattr(response, 'text'):
-                return response.text
+            history_text = [msg['content'] for msg in formatted_history]
+            text = self._generate(
+                'chat', (message, history_text), run,
+                priority=PRIORITY_CHAT,
+                tokens=estimate_tokens(message, *history_text) + RESPONSE_TOKENS
+            )
+            
+            if text:
+                return text
             else:
                 return "I apologize, but I couldn't generate a response. Please try again."
         except Exception as e:
@@ -46,7 +76,7 @@ class GeminiService:
             traceback.print_exc()
             return f"Error: {str(e)}"
 
-    def recognize_ingredients_from_image(self, image_data: bytes) -> List[str]:
+    def recognize_ingredients_from_image(self, image_data: bytes, timeout: Optional[float] = None) -> List[str]:
         """Use Gemini Vision to recognize ingredients from an image"""
         try:
             # Convert bytes to PIL Image
@@ -56,8 +86,14 @@ class GeminiService:
             Return only a comma-separated list of ingredient names, nothing else.
             Example: tomato, onion, garlic, chicken, salt, pepper"""
             
-            response = self.vision_model.generate_content([prompt, image])
-            ingredients_text = response.text.strip()
+            # Images are billed at a flat token rate
+            ingredients_text = self._generate(
+                'vision', (prompt, image_data),
+                lambda: self.vision_model.generate_content([prompt, image]),
+                priority=PRIORITY_VISION,
+                tokens=estimate_tokens(prompt) + 258 + RESPONSE_TOKENS,
+                timeout=timeout
+            ).strip()
             
             # Parse the comma-separated list
             ingredients = [ing.strip() for ing in ingredients_text.split(',') if ing.strip()]
@@ -87,24 +123,30 @@ class GeminiService:
             2. Step two
             etc."""
             
-            response = self.model.generate_content(prompt)
-            steps_text = response.text.strip()
-            
-            # Parse steps
-            steps = []
-            for line in steps_text.split('\n'):
-                line = line.strip()
-                if line and (line[0].isdigit() or line.startswith('-')):
-                    # Remove numbering/bullets
-                    step = line.split('.', 1)[-1].strip()
-                    if step:
-                        steps.append(step)
-            
+            steps_text = self._generate(
+                'steps', (prompt,),
+                lambda: self.model.generate_content(prompt),
+                priority=PRIORITY_BACKGROUND,
+                tokens=estimate_tokens(prompt) + RESPONSE_TOKENS
+            ).strip()
+            steps = self.parse_steps(steps_text)
             return steps if steps else [recipe_text]
         except Exception as e:
             print(f"Error extracting steps: {str(e)}")
             return [recipe_text]
 
+    def parse_steps(self, steps_text: str) -> List[str]:
+        """Parse a numbered or bulleted list of steps from model output"""
+        steps = []
+        for line in steps_text.split('\n'):
+            line = line.strip()
+            if line and (line[0].isdigit() or line.startswith('-')):
+                # Remove numbering/bullets
+                step = line.split('.', 1)[-1].strip()
+                if step:
+                    steps.append(step)
+        return steps
+
     def customize_recipe(self, recipe_text: str, user_request: str, serving_size: Optional[int] = None) -> str:
         """Customize recipe based on user preferences"""
         try:
@@ -117,8 +159,50 @@ class GeminiService:
             
             Provide the modified recipe with updated ingredients and instructions."""
             
-            response = self.model.generate_content(prompt)
-            return response.text
+            return self._generate(
+                'customize', (prompt,),
+                lambda: self.model.generate_content(prompt),
+                priority=PRIORITY_CUSTOMIZE,
+                tokens=estimate_tokens(prompt) + RESPONSE_TOKENS * 2
+            )
         except Exception as e:
             return f"Error customizing recipe: {str(e)}"
 
+
+    def customize_steps(self, title: str, steps: Dict[int, str], user_request: str,
+                        ingredients: Optional[Dict[int, str]] = None) -> Tuple[Dict[int, str], Dict[int, str]]:
+        """Rewrite only the given recipe steps and ingredient lines (keyed by index) for the user's request.
+
+        Returns (step edits, ingredient edits) keyed by the same indexes; lines the
+        model leaves out are unchanged. A new line may be returned under the next free number.
+        """
+        try:
+            ingredients_block = "\n".join(f"I{index + 1}. {text}" for index, text in sorted((ingredients or {}).items()))
+            steps_block = "\n".join(f"{index + 1}. {text}" for index, text in sorted(steps.items()))
+            prompt = f"""You are editing the recipe "{title}" for this request: {user_request}
+            
+            These are the affected ingredients and steps, with their numbers:
+            {ingredients_block}
+            {steps_block}
+            
+            Rewrite only the lines that need to change, including the ingredient lines for any
+            substitution or change in quantity. Return each rewritten line on its own line as
+            "I<number>. <new text>" for an ingredient or "<number>. <new text>" for a step,
+            keeping the original numbers. Return nothing else."""
+            
+            text = self._generate(
+                'customize_steps', (prompt,),
+                lambda: self.model.generate_content(prompt),
+                priority=PRIORITY_CUSTOMIZE,
+                tokens=estimate_tokens(prompt) + RESPONSE_TOKENS
+            )
+            edits, ingredient_edits = {}, {}
+            for line in text.strip().split('\n'):
+                match = re.match(r'^\s*(I)?(\d+)[.)]\s*(.+)$', line, re.IGNORECASE)
+                if match:
+                    target = ingredient_edits if match.group(1) else edits
+                    target[int(match.group(2)) - 1] = match.group(3).strip()
+            return edits, ingredient_edits
+        except Exception as e:
+            print(f"Error customizing steps: {str(e)}")
+            return {}, {}
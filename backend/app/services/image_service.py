@@ -1,9 +1,159 @@
 import cv2
+import hashlib
 import numpy as np
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+from multipart.multipart import MultipartParser, parse_options_header
 from PIL import Image
 import io
 
+# Leading bytes of the image formats we accept
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+]
+# Enough leading bytes to tell every format above apart
+SIGNATURE_BYTES = 12
+
+
+class UploadRejected(Exception):
+    """An upload refused before it was fully read or decoded"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def detect_image_type(header: bytes) -> Optional[str]:
+    """Identify an image format from its first bytes, without decoding it"""
+    for signature, image_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class ImageUploadReader:
+    """Checks an image upload chunk by chunk as it arrives.
+
+    The magic bytes are checked as soon as the first bytes are in and the size
+    limit on every chunk, so bad or oversized uploads are rejected without
+    reading them whole.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._header = b''
+        self._checked = False
+        self._chunks: List[bytes] = []
+        self._digest = hashlib.sha256()
+
+    def feed(self, chunk: bytes) -> None:
+        if not self._checked:
+            self._header += chunk[:SIGNATURE_BYTES - len(self._header)]
+            if len(self._header) >= SIGNATURE_BYTES:
+                self._check()
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadRejected(413, f"Image is larger than {self.max_bytes // (1024 * 1024)} MB")
+        self._digest.update(chunk)
+        self._chunks.append(chunk)
+
+    def finish(self) -> Tuple[bytes, str]:
+        """The upload's bytes and SHA-256 hex digest"""
+        if not self.size:
+            raise UploadRejected(400, "Uploaded image is empty")
+        if not self._checked:
+            self._check()
+        return b''.join(self._chunks), self._digest.hexdigest()
+
+    def _check(self) -> None:
+        self._checked = True
+        if detect_image_type(self._header) is None:
+            raise UploadRejected(415, "Unsupported image type; upload a JPEG, PNG, GIF, BMP or WebP file")
+
+
+async def read_image_form(request, image_field: str, max_bytes: int,
+                          max_field_bytes: int) -> Tuple[Dict[str, List[str]], Optional[Tuple[bytes, str]]]:
+    """Parse a form straight off the request body, returning its text fields and the image (bytes, hash).
+
+    The image part is checked while the body streams in, so an upload that is
+    not an image, or is too large, is refused on the chunk that shows it rather
+    than after the whole body has been received and spooled.
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data':
+        # URL-encoded forms cannot carry a file
+        form = await request.form()
+        return {key: form.getlist(key) for key in form.keys()}, None
+    boundary = params.get(b'boundary')
+    if not boundary:
+        raise UploadRejected(400, "Missing multipart boundary")
+
+    events: List[Tuple[str, bytes]] = []
+    parser = MultipartParser(boundary, {
+        'on_header_field': lambda data, start, end: events.append(('header_field', data[start:end])),
+        'on_header_value': lambda data, start, end: events.append(('header_value', data[start:end])),
+        'on_header_end': lambda: events.append(('header_end', b'')),
+        'on_headers_finished': lambda: events.append(('headers_finished', b'')),
+        'on_part_data': lambda data, start, end: events.append(('data', data[start:end])),
+        'on_part_end': lambda: events.append(('part_end', b'')),
+    })
+    fields: Dict[str, List[str]] = {}
+    image = None
+    part = {'field': b'', 'value': b'', 'disposition': b''}
+    field_bytes = 0
+
+    def handle_events() -> None:
+        nonlocal image, field_bytes
+        for kind, data in events:
+            if kind == 'header_field':
+                part['field'] += data
+            elif kind == 'header_value':
+                part['value'] += data
+            elif kind == 'header_end':
+                if part['field'].lower() == b'content-disposition':
+                    part['disposition'] = part['value']
+                part['field'] = part['value'] = b''
+            elif kind == 'headers_finished':
+                _, options = parse_options_header(part['disposition'])
+                part['name'] = options.get(b'name', b'').decode('utf-8', errors='replace')
+                part['filename'] = options.get(b'filename')
+                part['reader'] = ImageUploadReader(max_bytes) if part['name'] == image_field else None
+                part['chunks'] = []
+            elif kind == 'data':
+                if part['reader'] is not None:
+                    part['reader'].feed(data)
+                    continue
+                field_bytes += len(data)
+                if field_bytes > max_field_bytes:
+                    raise UploadRejected(413, "Form fields are too large")
+                part['chunks'].append(data)
+            elif kind == 'part_end':
+                reader = part['reader']
+                if reader is None:
+                    value = b''.join(part['chunks']).decode('utf-8', errors='replace')
+                    fields.setdefault(part['name'], []).append(value)
+                elif reader.size or part['filename']:
+                    # Browsers send an empty part without a file name when no file was chosen
+                    if image is not None:
+                        raise UploadRejected(400, "Upload one image at a time")
+                    image = reader.finish()
+                part['disposition'] = b''
+        events.clear()
+
+    async for chunk in request.stream():
+        parser.write(chunk)
+        handle_events()
+    parser.finalize()
+    handle_events()
+    return fields, image
+
 
 class ImageService:
     def __init__(self):
@@ -47,6 +197,12 @@ class ImageService:
             print(f"Error preprocessing image: {str(e)}")
             return image_data
 
+    def prepare_image(self, image_data: bytes) -> bytes:
+        """Preprocess a valid image for recognition; anything else is passed through as is"""
+        if self.validate_image(image_data):
+            return self.preprocess_image(image_data)
+        return image_data
+
     def validate_image(self, image_data: bytes) -> bool:
         """Validate that the uploaded file is a valid image"""
         try:
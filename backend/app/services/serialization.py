@@ -0,0 +1,47 @@
+"""Encode recipe listings straight to JSON bytes.
+
+Listings are built from the plain recipe dicts the agent keeps, without going
+through pydantic models, and the bytes are cached per conversation once every
+recipe in it is enriched. The shape still follows models.schemas (RecipeResponse,
+BatchItemResponse), which the API documents. orjson is used when it is installed.
+"""
+import json
+from typing import Any, Dict, List
+
+from ..models.schemas import Recipe
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fields of models.schemas.Recipe, in the same order; has_transcript is computed below
+RECIPE_FIELDS = tuple(field for field in Recipe.model_fields if field != 'has_transcript')
+RECIPE_DEFAULTS = {'title': 'Unknown', 'source': 'unknown', 'url': '', 'steps': [], 'enriched': False}
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def recipe_payload(recipe: Dict[str, Any], include_transcript: bool = True) -> Dict[str, Any]:
+    """Response shape of one recipe; without the transcript, has_transcript tells clients to fetch it"""
+    payload = {field: recipe.get(field, RECIPE_DEFAULTS.get(field)) for field in RECIPE_FIELDS}
+    payload['ingredients'] = payload['ingredients'] or None
+    payload['has_transcript'] = bool(payload['transcript'])
+    if not include_transcript:
+        payload['transcript'] = None
+    return payload
+
+
+def encode_recipes(recipes: List[Dict[str, Any]], include_transcripts: bool = True) -> bytes:
+    return dumps([recipe_payload(recipe, include_transcripts) for recipe in recipes])
+
+
+def encode_listing(recipes: bytes, **fields: Any) -> bytes:
+    """JSON object with already encoded recipes under 'recipes' and the other fields encoded now"""
+    if not fields:
+        return b'{"recipes":' + recipes + b'}'
+    return b'{"recipes":' + recipes + b',' + dumps(fields)[1:]
@@ -0,0 +1,23 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Optional
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TIMEOUT_POOL_SIZE", "16")),
+    thread_name_prefix="upstream-call",
+)
+
+
+def call_with_timeout(fn: Callable[..., Any], timeout: Optional[float], *args, **kwargs) -> Any:
+    """Run fn with a hard timeout for clients that do not accept one.
+
+    Raises TimeoutError once timeout seconds pass. The call itself keeps running
+    in a pool thread; only the caller stops waiting for it.
+    """
+    if timeout is None:
+        return fn(*args, **kwargs)
+    future = _executor.submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        raise TimeoutError(f"{getattr(fn, '__name__', 'call')} timed out after {timeout:.1f}s")
@@ -1,7 +1,18 @@
 import requests
 from bs4 import BeautifulSoup
 from typing import List, Dict, Optional
+import os
 import re
+import urllib.parse
+
+from . import capture
+from .admission import get_guard, UpstreamUnavailable
+from .cache_service import get_cache
+
+# Connection failures or 5xx responses from one site before its other pages are skipped for a while
+HOST_FAILURE_THRESHOLD = int(os.getenv("HOST_FAILURE_THRESHOLD", "3"))
+# "Serves 4" / "Servings: 4" style labels on recipe pages
+SERVINGS_LABEL = re.compile(r'\b(?:serves|servings|yield|makes)\s*:?\s*(\d+)', re.IGNORECASE)
 
 
 class WebSearchService:
@@ -9,95 +20,189 @@ class WebSearchService:
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
+        self.page_cache = get_cache("pages", maxsize=512, ttl=24 * 3600)
+        self.search_cache = get_cache("web_searches", maxsize=256, ttl=3600)
+        # Pages that had no recipe, and recent download failures per site
+        self.recipe_misses = get_cache("recipe_misses", maxsize=2048, ttl=1800)
+        self.host_failures = get_cache("host_failures", maxsize=1024, ttl=300)
+        self.session = requests.Session()
+        self.search_guard = get_guard("duckduckgo")
+        self.page_guard = get_guard("web_pages")
 
-    def search_recipes(self, query: str, max_results: int = 5) -> List[Dict]:
+    def search_recipes(self, query: str, max_results: int = 5, timeout: float = 10) -> List[Dict]:
         """Search for recipes using DuckDuckGo or Google search"""
+        # Concurrent identical searches share one request
+        recipes = self.search_cache.get_or_compute(
+            (query, max_results),
+            lambda: self._search(query, max_results, timeout)
+        )
+        return [dict(recipe) for recipe in recipes]
+
+    def _search(self, query: str, max_results: int, timeout: float) -> List[Dict]:
         try:
             # Using DuckDuckGo HTML search (free, no API key needed)
             search_url = f"https://html.duckduckgo.com/html/?q={query.replace(' ', '+')}+recipe"
             
-            response = requests.get(search_url, headers=self.headers, timeout=10)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            recipes = []
-            results = soup.find_all('a', class_='result__a', limit=max_results)
-            
-            for result in results:
-                url = result.get('href', '')
-                title = result.get_text(strip=True)
-                
-                if url and title:
-                    recipes.append({
-                        'title': title,
-                        'url': url,
-                        'source': 'web',
-                        'thumbnail': None
-                    })
-            
-            return recipes
+            html = capture.upstream(
+                'web_search', search_url,
+                lambda: self._fetch_html(search_url, timeout, self.search_guard, raise_for_status=True)
+            )
+            return self.parse_search_results(html, max_results)
         except Exception as e:
             print(f"Error searching web: {str(e)}")
             return []
 
-    def extract_recipe_from_url(self, url: str) -> Optional[Dict]:
+    def _fetch_html(self, url: str, timeout: float, guard, raise_for_status: bool = False,
+                    site_errors: tuple = ()) -> str:
+        # site_errors are one site's own failures; they are left out of the shared breaker
+        with guard.call(timeout=timeout, neutral=site_errors):
+            response = self.session.get(url, headers=self.headers, timeout=timeout)
+            if raise_for_status:
+                response.raise_for_status()
+        if response.status_code >= 500:
+            # Raised outside the guard: one failing site should not open the breaker for every page
+            response.raise_for_status()
+        return response.text
+
+    def parse_search_results(self, html: str, max_results: int = 5) -> List[Dict]:
+        """Parse result links out of a DuckDuckGo HTML results page"""
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        recipes = []
+        results = soup.find_all('a', class_='result__a', limit=max_results)
+        
+        for result in results:
+            url = result.get('href', '')
+            title = result.get_text(strip=True)
+            
+            if url and title:
+                recipes.append({
+                    'title': title,
+                    'url': url,
+                    'source': 'web',
+                    'thumbnail': None
+                })
+        
+        return recipes
+
+    def cached_recipe(self, url: str) -> Optional[Dict]:
+        """Return previously extracted recipe details for url, without downloading it"""
+        recipe_data = self.page_cache.get(url)
+        return dict(recipe_data) if recipe_data else None
+
+    def recipe_missing(self, url: str) -> bool:
+        """Whether the page recently had no recipe, or its site keeps failing"""
+        if self.recipe_misses.get(url):
+            return True
+        return self.host_failures.get(self._host(url), 0) >= HOST_FAILURE_THRESHOLD
+
+    def extract_recipe_from_url(self, url: str, timeout: float = 10) -> Optional[Dict]:
         """Extract recipe details from a blog/website URL"""
+        if self.recipe_missing(url):
+            return None
+        recipe_data = self.page_cache.get_or_compute(url, lambda: self._extract_recipe(url, timeout))
+        return dict(recipe_data) if recipe_data else None
+
+    def _extract_recipe(self, url: str, timeout: float) -> Optional[Dict]:
+        host = self._host(url)
         try:
-            response = requests.get(url, headers=self.headers, timeout=10)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Try to find recipe content (common patterns)
-            recipe_data = {
-                'title': '',
-                'ingredients': [],
-                'instructions': [],
-                'description': ''
-            }
-            
-            # Find title
-            title_tag = soup.find('h1') or soup.find('title')
-            if title_tag:
-                recipe_data['title'] = title_tag.get_text(strip=True)
-            
-            # Find ingredients (common class names)
-            ingredient_patterns = [
-                {'class': 'ingredient'},
-                {'class': 'ingredients'},
-                {'itemprop': 'recipeIngredient'},
-                {'class': 'recipe-ingredient'}
-            ]
-            
-            for pattern in ingredient_patterns:
-                ingredients = soup.find_all('li', pattern)
-                if ingredients:
-                    recipe_data['ingredients'] = [ing.get_text(strip=True) for ing in ingredients]
-                    break
-            
-            # Find instructions/steps
-            instruction_patterns = [
-                {'class': 'instruction'},
-                {'class': 'instructions'},
-                {'class': 'step'},
-                {'itemprop': 'recipeInstructions'}
-            ]
-            
-            for pattern in instruction_patterns:
-                instructions = soup.find_all('li', pattern)
-                if instructions:
-                    recipe_data['instructions'] = [inst.get_text(strip=True) for inst in instructions]
-                    break
-            
-            # If no structured data found, try to extract from paragraphs
-            if not recipe_data['instructions']:
-                # Look for numbered lists or paragraphs with cooking keywords
-                all_text = soup.get_text()
-                # Simple heuristic: split by common step indicators
-                steps = re.split(r'\n\s*\d+[\.\)]\s*', all_text)
-                if len(steps) > 1:
-                    recipe_data['instructions'] = [s.strip() for s in steps[1:6] if len(s.strip()) > 20]
-            
-            return recipe_data if recipe_data['title'] or recipe_data['instructions'] else None
-            
+            html = capture.upstream(
+                'web_page', url,
+                lambda: self._fetch_html(url, timeout, self.page_guard, site_errors=(requests.ConnectionError,))
+            )
+        except UpstreamUnavailable as e:
+            # Our own limits, not the site's fault
+            print(f"Skipping recipe page {url}: {str(e)}")
+            return None
+        except requests.Timeout as e:
+            # Possibly cut short by the request budget, so not held against the site
+            print(f"Timed out fetching recipe page {url}: {str(e)}")
+            return None
+        except (requests.ConnectionError, requests.HTTPError) as e:
+            # Connection failures and 5xx responses (the only status errors raised for pages)
+            print(f"Error extracting recipe from URL: {str(e)}")
+            self.host_failures.incr(host)
+            return None
         except Exception as e:
             print(f"Error extracting recipe from URL: {str(e)}")
             return None
+        
+        self.host_failures.delete(host)
+        try:
+            recipe_data = self.parse_recipe_page(html)
+        except Exception as e:
+            print(f"Error extracting recipe from URL: {str(e)}")
+            recipe_data = None
+        if recipe_data is None:
+            self.recipe_misses.set(url, True)
+        return recipe_data
+
+    def _host(self, url: str) -> str:
+        return urllib.parse.urlsplit(url).netloc.lower()
 
+    def parse_recipe_page(self, html: str) -> Optional[Dict]:
+        """Pull title, ingredients and instructions out of a recipe page"""
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        # Try to find recipe content (common patterns)
+        recipe_data = {
+            'title': '',
+            'ingredients': [],
+            'instructions': [],
+            'description': '',
+            'servings': None
+        }
+        
+        # Find title
+        title_tag = soup.find('h1') or soup.find('title')
+        if title_tag:
+            recipe_data['title'] = title_tag.get_text(strip=True)
+        
+        # Find ingredients (common class names)
+        ingredient_patterns = [
+            {'class': 'ingredient'},
+            {'class': 'ingredients'},
+            {'itemprop': 'recipeIngredient'},
+            {'class': 'recipe-ingredient'}
+        ]
+        
+        for pattern in ingredient_patterns:
+            ingredients = soup.find_all('li', pattern)
+            if ingredients:
+                recipe_data['ingredients'] = [ing.get_text(strip=True) for ing in ingredients]
+                break
+        
+        # Find servings: the structured yield, or a "Serves 4" / "Servings: 4" label
+        yield_tag = soup.find(attrs={'itemprop': 'recipeYield'})
+        if yield_tag:
+            match = re.search(r'\d+', yield_tag.get('content') or yield_tag.get_text(strip=True))
+        else:
+            label = soup.find(string=SERVINGS_LABEL)
+            match = SERVINGS_LABEL.search(label) if label else None
+        if match:
+            recipe_data['servings'] = int(match.group(match.lastindex or 0))
+        
+        # Find instructions/steps
+        instruction_patterns = [
+            {'class': 'instruction'},
+            {'class': 'instructions'},
+            {'class': 'step'},
+            {'itemprop': 'recipeInstructions'}
+        ]
+        
+        for pattern in instruction_patterns:
+            instructions = soup.find_all('li', pattern)
+            if instructions:
+                recipe_data['instructions'] = [inst.get_text(strip=True) for inst in instructions]
+                break
+        
+        # If no structured data found, try to extract from paragraphs
+        if not recipe_data['instructions']:
+            # Look for numbered lists or paragraphs with cooking keywords
+            all_text = soup.get_text()
+            # Simple heuristic: split by common step indicators
+            steps = re.split(r'\n\s*\d+[\.\)]\s*', all_text)
+            if len(steps) > 1:
+                recipe_data['instructions'] = [s.strip() for s in steps[1:6] if len(s.strip()) > 20]
+        
+        return recipe_data if recipe_data['title'] or recipe_data['instructions'] else None
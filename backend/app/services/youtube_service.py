@@ -1,9 +1,21 @@
-from youtube_transcript_api import YouTubeTranscriptApi
+from youtube_transcript_api import (
+    YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound,
+    NoTranscriptAvailable, VideoUnavailable
+)
 from typing import List, Dict, Optional
 import re
 import requests
 from bs4 import BeautifulSoup
 import urllib.parse
+import time
+
+from . import capture
+from .admission import get_guard, UpstreamUnavailable
+from .cache_service import get_cache
+from .timeouts import call_with_timeout
+
+# Errors that mean the video has no usable transcript, not that YouTube is failing
+TRANSCRIPT_MISSING_ERRORS = (TranscriptsDisabled, NoTranscriptFound, NoTranscriptAvailable, VideoUnavailable)
 
 
 class YouTubeService:
@@ -11,105 +23,36 @@ class YouTubeService:
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self.transcript_cache = get_cache("transcripts", maxsize=512, ttl=24 * 3600)
+        # Videos found to have no transcript at all, and the language that worked for the others
+        self.missing_transcripts = get_cache("missing_transcripts", maxsize=2048, ttl=1800)
+        self.transcript_languages = get_cache("transcript_languages", maxsize=4096, ttl=7 * 24 * 3600)
+        self.search_cache = get_cache("youtube_searches", maxsize=256, ttl=3600)
+        self.session = requests.Session()
+        self.search_guard = get_guard("youtube")
+        self.transcript_guard = get_guard("youtube_transcripts")
 
-    def search_recipes(self, query: str, max_results: int = 5) -> List[Dict]:
+    def search_recipes(self, query: str, max_results: int = 5, timeout: float = 10) -> List[Dict]:
         """Search YouTube for recipe videos using web scraping"""
+        # Concurrent identical searches share one request
+        videos = self.search_cache.get_or_compute(
+            (query, max_results),
+            lambda: self._search(query, max_results, timeout)
+        )
+        return [dict(video) for video in videos]
+
+    def _search(self, query: str, max_results: int, timeout: float) -> List[Dict]:
         try:
             search_query = f"{query} recipe cooking"
             # URL encode the search query
             encoded_query = urllib.parse.quote_plus(search_query)
             search_url = f"https://www.youtube.com/results?search_query={encoded_query}"
             
-            response = requests.get(search_url, headers=self.headers, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            videos = []
-            
-            # YouTube stores video data in script tags with JSON
-            # Look for the initial data that contains video information
-            scripts = soup.find_all('script')
-            video_data_found = False
-            
-            for script in scripts:
-                if script.string and 'var ytInitialData' in script.string:
-                    # Extract JSON data
-                    script_text = script.string
-                    # Find the JSON object
-                    start_idx = script_text.find('var ytInitialData = ')
-                    if start_idx != -1:
-                        start_idx += len('var ytInitialData = ')
-                        # Find the end of the JSON object (simplified - find matching brace)
-                        brace_count = 0
-                        end_idx = start_idx
-                        for i, char in enumerate(script_text[start_idx:], start_idx):
-                            if char == '{':
-                                brace_count += 1
-                            elif char == '}':
-                                brace_count -= 1
-                                if brace_count == 0:
-                                    end_idx = i + 1
-                                    break
-                        
-                        if end_idx > start_idx:
-                            try:
-                                import json
-                                json_str = script_text[start_idx:end_idx]
-                                data = json.loads(json_str)
-                                # Navigate the complex YouTube data structure
-                                contents = data.get('contents', {}).get('twoColumnSearchResultsRenderer', {}).get('primaryContents', {}).get('sectionListRenderer', {}).get('contents', [])
-                                
-                                for section in contents:
-                                    item_section = section.get('itemSectionRenderer', {}).get('contents', [])
-                                    for item in item_section:
-                                        video_renderer = item.get('videoRenderer', {})
-                                        if video_renderer:
-                                            video_id = video_renderer.get('videoId', '')
-                                            title = video_renderer.get('title', {}).get('runs', [{}])[0].get('text', 'Unknown Recipe')
-                                            thumbnail_data = video_renderer.get('thumbnail', {}).get('thumbnails', [])
-                                            thumbnail = thumbnail_data[-1].get('url', '') if thumbnail_data else ''
-                                            
-                                            if video_id and len(videos) < max_results:
-                                                videos.append({
-                                                    'title': title,
-                                                    'url': f"https://www.youtube.com/watch?v={video_id}",
-                                                    'thumbnail': thumbnail,
-                                                    'duration': '',
-                                                    'video_id': video_id,
-                                                    'source': 'youtube'
-                                                })
-                                                video_data_found = True
-                                                
-                                                if len(videos) >= max_results:
-                                                    break
-                                    
-                                    if len(videos) >= max_results:
-                                        break
-                            except Exception as e:
-                                print(f"Error parsing YouTube JSON: {str(e)}")
-                                continue
-            
-            # Fallback: Simple regex search if JSON parsing fails
-            if not video_data_found or len(videos) == 0:
-                # Look for video links in the page
-                video_links = soup.find_all('a', href=re.compile(r'/watch\?v='))
-                seen_ids = set()
-                
-                for link in video_links[:max_results * 2]:  # Get more to filter
-                    href = link.get('href', '')
-                    if '/watch?v=' in href:
-                        video_id = href.split('watch?v=')[1].split('&')[0]
-                        if video_id not in seen_ids and len(videos) < max_results:
-                            seen_ids.add(video_id)
-                            title = link.get('title', 'Unknown Recipe') or 'Unknown Recipe'
-                            videos.append({
-                                'title': title,
-                                'url': f"https://www.youtube.com/watch?v={video_id}",
-                                'thumbnail': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg",
-                                'duration': '',
-                                'video_id': video_id,
-                                'source': 'youtube'
-                            })
+            html = capture.upstream(
+                'youtube_search', search_url,
+                lambda: self._fetch_html(search_url, timeout)
+            )
+            videos = self.parse_search_results(html, max_results)
             
             print(f"Found {len(videos)} YouTube videos for query: {query}")
             return videos
@@ -119,27 +62,176 @@ class YouTubeService:
             traceback.print_exc()
             return []
 
-    def get_transcript(self, video_id: str) -> Optional[str]:
-        """Get transcript from YouTube video"""
+    def _fetch_html(self, url: str, timeout: float) -> str:
+        with self.search_guard.call(timeout=timeout):
+            response = self.session.get(url, headers=self.headers, timeout=timeout)
+            response.raise_for_status()
+        return response.text
+
+    def parse_search_results(self, html: str, max_results: int = 5) -> List[Dict]:
+        """Parse video results out of a YouTube search results page"""
+        soup = BeautifulSoup(html, 'html.parser')
+        videos = []
+        
+        # YouTube stores video data in script tags with JSON
+        # Look for the initial data that contains video information
+        scripts = soup.find_all('script')
+        video_data_found = False
+        
+        for script in scripts:
+            if script.string and 'var ytInitialData' in script.string:
+                # Extract JSON data
+                script_text = script.string
+                # Find the JSON object
+                start_idx = script_text.find('var ytInitialData = ')
+                if start_idx != -1:
+                    start_idx += len('var ytInitialData = ')
+                    # Find the end of the JSON object (simplified - find matching brace)
+                    brace_count = 0
+                    end_idx = start_idx
+                    for i, char in enumerate(script_text[start_idx:], start_idx):
+                        if char == '{':
+                            brace_count += 1
+                        elif char == '}':
+                            brace_count -= 1
+                            if brace_count == 0:
+                                end_idx = i + 1
+                                break
+                    
+                    if end_idx > start_idx:
+                        try:
+                            import json
+                            json_str = script_text[start_idx:end_idx]
+                            data = json.loads(json_str)
+                            # Navigate the complex YouTube data structure
+                            contents = data.get('contents', {}).get('twoColumnSearchResultsRenderer', {}).get('primaryContents', {}).get('sectionListRenderer', {}).get('contents', [])
+                            
+                            for section in contents:
+                                item_section = section.get('itemSectionRenderer', {}).get('contents', [])
+                                for item in item_section:
+                                    video_renderer = item.get('videoRenderer', {})
+                                    if video_renderer:
+                                        video_id = video_renderer.get('videoId', '')
+                                        title = video_renderer.get('title', {}).get('runs', [{}])[0].get('text', 'Unknown Recipe')
+                                        thumbnail_data = video_renderer.get('thumbnail', {}).get('thumbnails', [])
+                                        thumbnail = thumbnail_data[-1].get('url', '') if thumbnail_data else ''
+                                        
+                                        if video_id and len(videos) < max_results:
+                                            videos.append({
+                                                'title': title,
+                                                'url': f"https://www.youtube.com/watch?v={video_id}",
+                                                'thumbnail': thumbnail,
+                                                'duration': '',
+                                                'video_id': video_id,
+                                                'source': 'youtube'
+                                            })
+                                            video_data_found = True
+                                            
+                                            if len(videos) >= max_results:
+                                                break
+                                
+                                if len(videos) >= max_results:
+                                    break
+                        except Exception as e:
+                            print(f"Error parsing YouTube JSON: {str(e)}")
+                            continue
+        
+        # Fallback: Simple regex search if JSON parsing fails
+        if not video_data_found or len(videos) == 0:
+            # Look for video links in the page
+            video_links = soup.find_all('a', href=re.compile(r'/watch\?v='))
+            seen_ids = set()
+            
+            for link in video_links[:max_results * 2]:  # Get more to filter
+                href = link.get('href', '')
+                if '/watch?v=' in href:
+                    video_id = href.split('watch?v=')[1].split('&')[0]
+                    if video_id not in seen_ids and len(videos) < max_results:
+                        seen_ids.add(video_id)
+                        title = link.get('title', 'Unknown Recipe') or 'Unknown Recipe'
+                        videos.append({
+                            'title': title,
+                            'url': f"https://www.youtube.com/watch?v={video_id}",
+                            'thumbnail': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg",
+                            'duration': '',
+                            'video_id': video_id,
+                            'source': 'youtube'
+                        })
+        
+        return videos
+
+    def cached_transcript(self, video_id: str) -> Optional[str]:
+        """Return the transcript if it has already been fetched, without hitting YouTube"""
+        return self.transcript_cache.get(video_id)
+
+    def transcript_missing(self, video_id: str) -> bool:
+        """Whether the video was recently found to have no transcript in any language"""
+        return bool(self.missing_transcripts.get(video_id))
+
+    def get_transcript(self, video_id: str, timeout: Optional[float] = None) -> Optional[str]:
+        """Get transcript from YouTube video, giving up after `timeout` seconds if set"""
+        if self.transcript_missing(video_id):
+            return None
+        return self.transcript_cache.get_or_compute(
+            video_id,
+            lambda: capture.upstream('transcript', video_id, lambda: self._fetch_transcript(video_id, timeout))
+        )
+
+    def _fetch_transcript(self, video_id: str, timeout: Optional[float] = None) -> Optional[str]:
+        # The transcript API has no timeout of its own, so every call is bounded here
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        def remaining() -> Optional[float]:
+            if deadline is None:
+                return None
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise TimeoutError(f"Transcript for {video_id} timed out")
+            return left
+
+        # Go straight to the language that worked last time, if any
+        language = self.transcript_languages.get(video_id)
+        languages = (language,) if language else ('en',)
+        # Only a definite "no transcript" answer is remembered, not timeouts or network errors
+        transient = False
         try:
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
+            with self.transcript_guard.call(ignore=TRANSCRIPT_MISSING_ERRORS, timeout=timeout):
+                transcript_list = call_with_timeout(YouTubeTranscriptApi.get_transcript, remaining(), video_id, languages)
             transcript_text = ' '.join([item['text'] for item in transcript_list])
             return transcript_text
+        except (UpstreamUnavailable, TimeoutError) as e:
+            print(f"Skipping transcript for {video_id}: {str(e)}")
+            return None
         except Exception as e:
             print(f"Error getting transcript: {str(e)}")
-            # Try to get transcript in different languages
-            try:
-                transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-                for transcript in transcript_list:
-                    try:
-                        fetched = transcript.fetch()
-                        transcript_text = ' '.join([item['text'] for item in fetched])
-                        return transcript_text
-                    except:
-                        continue
-            except:
-                pass
+            transient = not isinstance(e, TRANSCRIPT_MISSING_ERRORS)
+        
+        # Try to get transcript in different languages
+        try:
+            with self.transcript_guard.call(ignore=TRANSCRIPT_MISSING_ERRORS, timeout=timeout):
+                transcript_list = call_with_timeout(YouTubeTranscriptApi.list_transcripts, remaining(), video_id)
+            for transcript in transcript_list:
+                try:
+                    with self.transcript_guard.call(ignore=TRANSCRIPT_MISSING_ERRORS, timeout=timeout):
+                        fetched = call_with_timeout(transcript.fetch, remaining())
+                    self.transcript_languages.set(video_id, transcript.language_code)
+                    transcript_text = ' '.join([item['text'] for item in fetched])
+                    return transcript_text
+                except (UpstreamUnavailable, TimeoutError):
+                    return None
+                except TRANSCRIPT_MISSING_ERRORS:
+                    continue
+                except Exception:
+                    transient = True
+                    continue
+        except TRANSCRIPT_MISSING_ERRORS:
+            pass
+        except Exception:
             return None
+        
+        if not transient:
+            self.missing_transcripts.set(video_id, True)
+        return None
 
     def extract_steps_from_transcript(self, transcript: str) -> List[str]:
         """Extract cooking steps from transcript text"""
@@ -0,0 +1,247 @@
+"""Measure the CPU and memory cost of the scrapers and parsers on saved pages.
+
+Runs the YouTube and DuckDuckGo result parsers, the recipe page extractor and
+the transcript step extractor against the fixtures in benchmarks/fixtures,
+both directly and through the public service methods (with upstream responses
+served from the fixtures instead of the network). Reports throughput, peak
+and retained memory per call, and fails when a result crosses its threshold
+in parser_thresholds.json.
+
+    python benchmarks/bench_parsers.py
+    python benchmarks/bench_parsers.py --filter transcript --min-time 3
+    python benchmarks/bench_parsers.py --archive captures/20260101-120000-ingredients-ab12cd34.jsonl.gz
+    python benchmarks/bench_parsers.py --write-thresholds
+
+Capture archives (see CAPTURE_DIR) add their recorded pages and transcripts
+to the corpus; thresholds only apply to the bundled fixtures.
+"""
+import argparse
+import contextlib
+import gc
+import gzip
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(BACKEND_DIR, "benchmarks", "fixtures")
+THRESHOLDS_PATH = os.path.join(BACKEND_DIR, "benchmarks", "parser_thresholds.json")
+
+# Upstream kinds recorded in capture archives, and the fixture each one stands in for
+ARCHIVE_KINDS = {
+    'youtube_search': 'youtube_search.html',
+    'web_search': 'duckduckgo_search.html',
+    'web_page': 'recipe_structured.html',
+    'transcript': 'transcript.txt',
+}
+
+
+def load_fixtures() -> dict:
+    fixtures = {}
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith('.gz'):
+            with gzip.open(os.path.join(FIXTURES_DIR, name), 'rt', encoding='utf-8') as f:
+                fixtures[name[:-3]] = f.read()
+    return fixtures
+
+
+def load_archive(path: str) -> dict:
+    """Recorded upstream responses from a capture archive, keyed like the fixtures"""
+    from app.services import capture
+
+    recording = capture.CaptureSession.load(path)
+    label = os.path.basename(path).split('.')[0]
+    corpus = {}
+    for n, event in enumerate(recording.events):
+        fixture = ARCHIVE_KINDS.get(event.get('kind'))
+        if event['type'] == 'upstream' and fixture and isinstance(event['value'], str):
+            corpus[f"{fixture}@{label}#{n}"] = event['value']
+    return corpus
+
+
+def benchmarks(corpus: dict) -> list:
+    """(name, document, function) for every parser and fixture it applies to"""
+    from app.services import capture
+    from app.services.youtube_service import YouTubeService
+    from app.services.web_search_service import WebSearchService
+
+    youtube = YouTubeService()
+    web_search = WebSearchService()
+
+    class FixtureSession(capture.CaptureSession):
+        """Answers every upstream call of a kind with the same document"""
+
+        def __init__(self, kind: str, document: str):
+            super().__init__('benchmark', {}, replaying=True)
+            self.kind = kind
+            self.document = document
+
+        def replay_upstream(self, kind, key):
+            if kind != self.kind:
+                raise capture.UpstreamNotRecorded(f"No fixture for {kind}")
+            return self.document
+
+    def through_service(kind, document, cache, call):
+        # Empty the cache every time so the fetch, parse and copy path is measured
+        def run():
+            cache.clear()
+            with capture.replaying(FixtureSession(kind, document)):
+                return call()
+        return run
+
+    cases = []
+    for name, document in corpus.items():
+        fixture = name.split('@')[0]
+        suffix = name[len(fixture):]
+        if fixture == 'youtube_search.html':
+            cases.append((f"youtube.parse_search_results{suffix}", document,
+                          lambda d=document: youtube.parse_search_results(d, 5)))
+            cases.append((f"youtube.search_recipes{suffix}", document,
+                          through_service('youtube_search', document, youtube.search_cache,
+                                          lambda: youtube.search_recipes("tomato onion garlic"))))
+        elif fixture == 'duckduckgo_search.html':
+            cases.append((f"web.parse_search_results{suffix}", document,
+                          lambda d=document: web_search.parse_search_results(d, 5)))
+            cases.append((f"web.search_recipes{suffix}", document,
+                          through_service('web_search', document, web_search.search_cache,
+                                          lambda: web_search.search_recipes("tomato onion garlic"))))
+        elif fixture.startswith('recipe_'):
+            page = fixture[:-len('.html')]
+            cases.append((f"web.parse_recipe_page[{page}]{suffix}", document,
+                          lambda d=document: web_search.parse_recipe_page(d)))
+            cases.append((f"web.extract_recipe_from_url[{page}]{suffix}", document,
+                          through_service('web_page', document, web_search.page_cache,
+                                          lambda: web_search.extract_recipe_from_url("https://example.com/recipe"))))
+        elif fixture == 'transcript.txt':
+            cases.append((f"youtube.extract_steps_from_transcript{suffix}", document,
+                          lambda d=document: youtube.extract_steps_from_transcript(d)))
+    return cases
+
+
+def measure(fn, size: int, min_time: float, repeat: int) -> dict:
+    # Services print progress; keep it out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not fn():
+            raise RuntimeError("benchmark returned no result")
+
+        best = None
+        for _ in range(repeat):
+            calls = 0
+            started = time.perf_counter()
+            while True:
+                fn()
+                calls += 1
+                elapsed = time.perf_counter() - started
+                if elapsed >= min_time:
+                    break
+            per_call = elapsed / calls
+            best = per_call if best is None else min(best, per_call)
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            result = fn()
+            _, peak = tracemalloc.get_traced_memory()
+            # Parse trees hold reference cycles; only count what outlives a collection
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        del result
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    return {
+        'ops_per_sec': 1 / best,
+        'mb_per_sec': size / best / 1e6,
+        'peak_kb': (peak - baseline) / 1024,
+        'retained_kb': (current - baseline) / 1024,
+        'blocks': blocks,
+    }
+
+
+def check(name: str, result: dict, thresholds: dict) -> list:
+    limits = thresholds.get(name)
+    if not limits:
+        return []
+    failures = []
+    if result['ops_per_sec'] < limits.get('min_ops_per_sec', 0):
+        failures.append(f"{name}: {result['ops_per_sec']:.1f} ops/s is below {limits['min_ops_per_sec']}")
+    if result['peak_kb'] > limits.get('max_peak_kb', float('inf')):
+        failures.append(f"{name}: peak {result['peak_kb']:.0f} KB is above {limits['max_peak_kb']}")
+    return failures
+
+
+def write_thresholds(results: dict, path: str, speed_margin: float, memory_margin: float) -> None:
+    """Record thresholds a margin away from the current results"""
+    thresholds = {
+        name: {
+            'min_ops_per_sec': round(result['ops_per_sec'] * speed_margin, 1),
+            'max_peak_kb': round(result['peak_kb'] * memory_margin + 64),
+        }
+        for name, result in results.items() if '@' not in name
+    }
+    with open(path, 'w') as f:
+        json.dump(thresholds, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Wrote thresholds for {len(thresholds)} benchmarks to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--archive", action="append", default=[], help="Also run on pages from a capture archive")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to run each timing round")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing rounds; the best one is reported")
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    parser.add_argument("--write-thresholds", action="store_true",
+                        help="Replace the thresholds with the current results, less a safety margin")
+    parser.add_argument("--speed-margin", type=float, default=0.5,
+                        help="Fraction of the measured throughput written as the minimum")
+    parser.add_argument("--memory-margin", type=float, default=1.5,
+                        help="Multiple of the measured peak memory written as the maximum")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ.update({"CACHE_BACKEND": "memory", "PREFETCH_ENABLED": "false"})
+    os.environ.pop("CAPTURE_DIR", None)
+
+    corpus = load_fixtures()
+    for path in args.archive:
+        corpus.update(load_archive(path))
+
+    thresholds = {}
+    if os.path.exists(args.thresholds) and not args.write_thresholds:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+
+    print(f"{'benchmark':<48} {'ops/s':>10} {'MB/s':>8} {'peak KB':>9} {'kept KB':>8} {'blocks':>7}")
+    results = {}
+    failures = []
+    for name, document, fn in benchmarks(corpus):
+        if args.filter and args.filter not in name:
+            continue
+        result = measure(fn, len(document.encode('utf-8')), args.min_time, args.repeat)
+        results[name] = result
+        failures.extend(check(name, result, thresholds))
+        print(f"{name:<48} {result['ops_per_sec']:>10.1f} {result['mb_per_sec']:>8.2f} "
+              f"{result['peak_kb']:>9.0f} {result['retained_kb']:>8.1f} {result['blocks']:>7}")
+
+    if args.write_thresholds:
+        write_thresholds(results, args.thresholds, args.speed_margin, args.memory_margin)
+        return
+    if failures:
+        print("\nRegressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Measure API throughput as the number of worker processes grows.
+
+Seeds a shared SQLite store with conversations, starts `python -m app` with
+1, 2, 4... workers and hammers GET /api/recipes from client processes.
+No network access or real Gemini key is needed.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --clients 16 --duration 10
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed_conversations(count: int) -> list:
+    """Write conversations with realistic recipe payloads into the shared store"""
+    sys.path.insert(0, BACKEND_DIR)
+    from app.services.cache_service import get_cache
+
+    conversations = get_cache("conversations", maxsize=10000, ttl=24 * 3600)
+    transcript = " ".join(["now add the onions and cook until golden brown."] * 400)
+    ids = []
+    for _ in range(count):
+        conversation_id = str(uuid.uuid4())
+        conversations[conversation_id] = {
+            'ingredients': ['tomato', 'onion', 'garlic'],
+            'conversation_history': [],
+            'recipes': [
+                {
+                    'title': f'Recipe {i}',
+                    'source': 'youtube',
+                    'url': f'https://www.youtube.com/watch?v=vid{i}',
+                    'video_id': f'vid{i}',
+                    'transcript': transcript,
+                    'steps': [f'Step {n}: stir the pot and season to taste' for n in range(20)],
+                    'enriched': True,
+                }
+                for i in range(5)
+            ],
+        }
+        ids.append(conversation_id)
+    return ids
+
+
+def client(args) -> int:
+    port, conversation_ids, duration = args
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    done = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        conversation_id = conversation_ids[done % len(conversation_ids)]
+        conn.request("GET", f"/api/recipes?conversation_id={conversation_id}")
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Unexpected status {response.status}")
+        done += 1
+    conn.close()
+    return done
+
+
+def wait_for_server(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+def run(workers: int, port: int, clients: int, duration: float, conversation_ids: list, env: dict) -> float:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app", "--workers", str(workers), "--port", str(port)],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server(port)
+        with multiprocessing.Pool(clients) as pool:
+            # Warm up every worker before measuring
+            pool.map(client, [(port, conversation_ids, 1.0)] * clients)
+            started = time.monotonic()
+            counts = pool.map(client, [(port, conversation_ids, duration)] * clients)
+            elapsed = time.monotonic() - started
+        return sum(counts) / elapsed
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="wtf-bench-")
+    env = dict(os.environ)
+    env.update({
+        "CACHE_BACKEND": "sqlite",
+        "CACHE_PATH": os.path.join(tmpdir, "cache.db"),
+        "GEMINI_API_KEY": env.get("GEMINI_API_KEY", "benchmark"),
+        "PREFETCH_ENABLED": "false",
+    })
+    os.environ.update(env)
+    conversation_ids = seed_conversations(100)
+
+    print(f"cores: {os.cpu_count()}, clients: {args.clients}, duration: {args.duration}s")
+    baseline = None
+    for workers in args.workers:
+        throughput = run(workers, args.port, args.clients, args.duration, conversation_ids, env)
+        baseline = baseline or throughput
+        print(f"workers={workers:<3} {throughput:10.1f} req/s  x{throughput / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# Gunicorn settings for multi-process serving: gunicorn -c gunicorn.conf.py app.main:app
+import multiprocessing
+import os
+
+# Conversation state and caches must live in the shared SQLite store when
+# requests for one conversation can land on any worker.
+os.environ.setdefault("CACHE_BACKEND", "sqlite")
+os.environ.setdefault("CACHE_PATH", os.path.abspath(".cache/whatthefridge.db"))
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
@@ -0,0 +1,39 @@
+import pytest
+import requests
+
+from app.services.admission import UpstreamGuard
+
+
+@pytest.fixture
+def guard(monkeypatch):
+    monkeypatch.setenv("SLOW_TEST_FAILURE_THRESHOLD", "2")
+    monkeypatch.setenv("SLOW_TEST_SLOW_SECONDS", "1.5")
+    return UpstreamGuard("slow_test")
+
+
+def time_out(guard, timeout):
+    with pytest.raises(requests.Timeout):
+        with guard.call(timeout=timeout):
+            raise requests.Timeout("timed out")
+
+
+def test_timeouts_cut_short_by_the_budget_are_not_counted(guard):
+    for _ in range(5):
+        time_out(guard, 0.5)
+    assert guard.breaker.failures == 0
+
+
+def test_timeouts_with_enough_time_open_the_breaker(guard):
+    # A budget-capped call that still had the provider's usual latency counts
+    time_out(guard, 2.5)
+    time_out(guard, 1.5)
+    assert guard.breaker.is_open
+
+
+def test_neutral_errors_do_not_count(guard):
+    for _ in range(5):
+        with pytest.raises(requests.ConnectionError):
+            with guard.call(neutral=(requests.ConnectionError,)):
+                raise requests.ConnectionError("host unreachable")
+    assert guard.breaker.failures == 0
+    assert not guard.breaker.is_open
@@ -0,0 +1,58 @@
+import pytest
+
+google_exceptions = pytest.importorskip("google.api_core.exceptions")
+
+from app.services.admission import UpstreamGuard
+from app.services.gemini_scheduler import GeminiScheduler, QuotaExceeded
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+    monkeypatch.setenv("GEMINI_RPM", "100000")
+    monkeypatch.setenv("GEMINI_MAX_RETRIES", "3")
+    monkeypatch.setenv("GEMINI_RETRY_BACKOFF", "0")
+    monkeypatch.setenv("GEMINI_TEST_FAILURE_THRESHOLD", "2")
+    scheduler = GeminiScheduler()
+    scheduler.guard = UpstreamGuard("gemini_test")
+    return scheduler
+
+
+def flaky(failures, error=lambda: google_exceptions.ResourceExhausted("quota exceeded")):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error()
+        return "ok"
+    return fn, calls
+
+
+def test_quota_errors_are_retried_without_opening_the_breaker(scheduler):
+    for _ in range(3):
+        fn, calls = flaky(2)
+        assert scheduler._with_retry(fn) == "ok"
+        assert len(calls) == 3
+    assert scheduler.guard.breaker.failures == 0
+    assert not scheduler.guard.breaker.is_open
+
+
+def test_exhausted_quota_retries_leave_the_breaker_closed(scheduler):
+    for _ in range(2):
+        fn, calls = flaky(10)
+        with pytest.raises(QuotaExceeded):
+            scheduler._with_retry(fn)
+        assert len(calls) == 4
+    assert not scheduler.guard.breaker.is_open
+    fn, _ = flaky(0)
+    assert scheduler._with_retry(fn) == "ok"
+
+
+def test_provider_errors_count_against_the_breaker(scheduler):
+    for _ in range(2):
+        fn, calls = flaky(1, lambda: google_exceptions.InternalServerError("boom"))
+        with pytest.raises(google_exceptions.InternalServerError):
+            scheduler._with_retry(fn)
+        assert len(calls) == 1
+    assert scheduler.guard.breaker.is_open
@@ -0,0 +1,125 @@
+import pytest
+
+from app.agent import recipe_editor
+
+
+def make_version(servings=None, ingredients=None, steps=None):
+    return recipe_editor.build_recipe_version({
+        'title': 'Pancakes',
+        'url': 'https://example.com/pancakes',
+        'servings': servings,
+        'ingredients': ingredients or [],
+        'steps': steps or [],
+    })
+
+
+@pytest.mark.parametrize('message, expected', [
+    ("Can you make it for 6 people?", {'servings': 6}),
+    ("I need 3 servings", {'servings': 3}),
+    ("scale it to 8", {'servings': 8}),
+    ("double the recipe", {'factor': 2.0}),
+    ("let's make a double batch", {'factor': 2.0}),
+    ("triple it", {'factor': 3.0}),
+    ("halve the recipe", {'factor': 0.5}),
+    ("half a batch is enough", {'factor': 0.5}),
+    ("cut it in half", {'factor': 0.5}),
+])
+def test_parse_serving_change(message, expected):
+    assert recipe_editor.parse_serving_change(message) == expected
+
+
+@pytest.mark.parametrize('message', [
+    "double check the oven temperature",
+    "I don't have half the butter",
+    "will this serve 2 kids?",
+    "what can I use instead of eggs",
+])
+def test_parse_serving_change_ignores_other_requests(message):
+    assert recipe_editor.parse_serving_change(message) is None
+
+
+def test_scale_recipe_to_servings():
+    version = make_version(
+        servings=4,
+        ingredients=['2 cups flour', '1 1/2 tbsp sugar', '½ tsp salt', 'butter for the pan'],
+        steps=['Whisk 2 cups flour with the sugar.', 'Cook for 3 minutes.'],
+    )
+    scaled = recipe_editor.scale_recipe(version, {'servings': 6})
+    assert scaled['servings'] == 6
+    assert scaled['ingredients'] == ['3 cups flour', '2 1/4 tbsp sugar', '3/4 tsp salt', 'butter for the pan']
+    # Quantities with a unit are scaled, cooking times are not
+    assert scaled['steps'] == ['Whisk 3 cups flour with the sugar.', 'Cook for 3 minutes.']
+    assert scaled['version'] == 2
+    assert scaled['changes'] == ['Scaled to 6 servings']
+    # The original version is left as it was
+    assert version['ingredients'][0] == '2 cups flour'
+
+
+def test_scale_recipe_by_factor_without_servings():
+    version = make_version(ingredients=['3 eggs'])
+    scaled = recipe_editor.scale_recipe(version, {'factor': 2.0})
+    assert scaled['ingredients'] == ['6 eggs']
+    assert scaled['servings'] is None
+    assert scaled['changes'] == ['Scaled x2']
+
+
+def test_scale_recipe_to_servings_needs_base():
+    version = make_version(ingredients=['2 cups flour'])
+    assert not recipe_editor.can_scale(version, {'servings': 6})
+    assert recipe_editor.needs_model("make it for 6 people", {'servings': 6}, version)
+    with pytest.raises(ValueError):
+        recipe_editor.scale_recipe(version, {'servings': 6})
+
+
+def test_apply_step_edits():
+    version = make_version(
+        ingredients=['2 tbsp butter', '1 cup milk'],
+        steps=['Melt the butter.', 'Add the milk.'],
+    )
+    edited = recipe_editor.apply_step_edits(
+        version, {0: 'Warm the oil.', 2: 'Serve warm.', 7: 'Ignored.'}, 'use oil', {0: '2 tbsp oil'}
+    )
+    assert edited['steps'] == ['Warm the oil.', 'Add the milk.', 'Serve warm.']
+    assert edited['ingredients'] == ['2 tbsp oil', '1 cup milk']
+    assert edited['changes'] == ['use oil']
+    assert version['steps'] == ['Melt the butter.', 'Add the milk.']
+
+
+def test_quantity_indexes():
+    lines = ['2 cups flour', 'salt to taste', 'Bake 200 g of dough', '¼ tsp nutmeg']
+    assert recipe_editor.quantity_indexes(lines) == [0, 2, 3]
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('Salt, ½ tsp', 'Salt, 1/4 tsp'),
+    ('2-3 cloves garlic', '1-1 1/2 cloves garlic'),
+    ('1 to 2 cups milk', '1/2 to 1 cups milk'),
+    ('2 large eggs', '1 large eggs'),
+    ('1½ cups flour', '3/4 cups flour'),
+    # Nothing to scale: the line is left exactly as written
+    ('butter for the pan', 'butter for the pan'),
+    ('Pepper, to taste ½', 'Pepper, to taste ½'),
+])
+def test_scale_recipe_ingredient_lines(line, expected):
+    version = make_version(servings=4, ingredients=[line])
+    assert recipe_editor.scale_recipe(version, {'servings': 2})['ingredients'] == [expected]
+
+
+def test_scale_recipe_scales_counted_ingredients_in_steps():
+    version = make_version(
+        servings=4,
+        ingredients=['2 large eggs', '2 cups flour'],
+        steps=['Beat 2 large eggs, then add 2-3 tbsp of the flour.', 'Rest for 2 hours.'],
+    )
+    scaled = recipe_editor.scale_recipe(version, {'servings': 2})
+    assert scaled['ingredients'] == ['1 large eggs', '1 cups flour']
+    assert scaled['steps'] == ['Beat 1 large eggs, then add 1-1 1/2 tbsp of the flour.', 'Rest for 2 hours.']
+
+
+def test_serving_change_with_instead_is_applied_locally():
+    version = make_version(servings=4, ingredients=['2 cups flour'])
+    message = "make it for 2 people instead"
+    change = recipe_editor.parse_serving_change(message)
+    assert change == {'servings': 2}
+    assert not recipe_editor.needs_model(message, change, version)
+    assert recipe_editor.needs_model("use oil instead of butter", None, version)
@@ -0,0 +1,31 @@
+import json
+
+from app.models.schemas import BatchItemResponse, Recipe, RecipeResponse
+from app.services.serialization import encode_listing, encode_recipes, recipe_payload
+
+RECIPES = [
+    {'title': 'Shakshuka', 'source': 'youtube', 'url': 'https://youtube.com/watch?v=abc', 'video_id': 'abc',
+     'transcript': 'Crack the eggs into the sauce', 'steps': ['Simmer the sauce'], 'enriched': True,
+     'servings': 2},
+    {'title': 'Tomato soup', 'source': 'web', 'url': 'https://example.com/soup'},
+]
+
+
+def test_recipe_payload_has_the_schema_fields():
+    assert list(recipe_payload(RECIPES[0])) == list(Recipe.model_fields)
+
+
+def test_listing_matches_recipe_response():
+    body = encode_listing(encode_recipes(RECIPES, include_transcripts=False), conversation_id='c1',
+                          partial=True, skipped_stages=['web_search'])
+    data = json.loads(body)
+    response = RecipeResponse.model_validate(data)
+    assert data == json.loads(response.model_dump_json())
+    assert response.recipes[0].has_transcript and response.recipes[0].transcript is None
+
+
+def test_batch_line_matches_batch_item_response():
+    body = encode_listing(encode_recipes(RECIPES), index=3, conversation_id='c2', partial=False,
+                          skipped_stages=[], error=None)
+    data = json.loads(body)
+    assert data == json.loads(BatchItemResponse.model_validate(data).model_dump_json())
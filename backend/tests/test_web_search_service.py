@@ -0,0 +1,32 @@
+import pytest
+import requests
+
+from app.services.admission import UpstreamGuard
+from app.services.web_search_service import HOST_FAILURE_THRESHOLD, WebSearchService
+
+
+class DeadHostSession:
+    def get(self, url, **kwargs):
+        raise requests.ConnectionError(f"Failed to resolve {url}")
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+    service = WebSearchService()
+    service.session = DeadHostSession()
+    service.page_guard = UpstreamGuard("web_pages_test")
+    service.host_failures.clear()
+    service.recipe_misses.clear()
+    return service
+
+
+def test_dead_hosts_are_skipped_without_opening_the_page_breaker(service):
+    hosts = [f"https://dead{n}.example/recipe" for n in range(3)]
+    for url in hosts:
+        for _ in range(HOST_FAILURE_THRESHOLD):
+            assert service.extract_recipe_from_url(url) is None
+    assert service.page_guard.breaker.failures == 0
+    assert not service.page_guard.breaker.is_open
+    assert all(service.recipe_missing(url) for url in hosts)
+    assert not service.recipe_missing("https://alive.example/recipe")
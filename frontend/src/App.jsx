@@ -1,18 +1,45 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import './App.css';
 import IngredientInput from './components/IngredientInput';
 import RecipeCard from './components/RecipeCard';
 import ChatInterface from './components/ChatInterface';
 
+const POLL_INTERVAL_MS = 2000;
+// Some recipes never get details (no transcript, no recipe on the page), so give up eventually
+const POLL_ATTEMPTS = 15;
+
 function App() {
   const [recipes, setRecipes] = useState([]);
   const [conversationId, setConversationId] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  const pollRef = useRef(null);
+
+  // Recipe details are fetched in the background; poll until they have all arrived
+  const pollRecipes = (id, attempt = 0) => {
+    clearTimeout(pollRef.current);
+    if (attempt >= POLL_ATTEMPTS) return;
+    pollRef.current = setTimeout(async () => {
+      try {
+        const response = await fetch(`http://localhost:8000/api/recipes?conversation_id=${id}`);
+        if (!response.ok) return;
+        const data = await response.json();
+        setRecipes(data.recipes || []);
+        if ((data.recipes || []).some(recipe => !recipe.enriched)) {
+          pollRecipes(id, attempt + 1);
+        }
+      } catch (err) {
+        console.error('Error refreshing recipes:', err);
+      }
+    }, POLL_INTERVAL_MS);
+  };
+
+  useEffect(() => () => clearTimeout(pollRef.current), []);
 
   const handleIngredientsSubmit = async (ingredients, craving, imageFile) => {
     setLoading(true);
     setError(null);
+    clearTimeout(pollRef.current);
     
     try {
       const formData = new FormData();
@@ -36,6 +63,9 @@ function App() {
       if (data.recipes && data.recipes.length > 0) {
         setRecipes(data.recipes);
         setConversationId(data.conversation_id);
+        if (data.recipes.some(recipe => !recipe.enriched)) {
+          pollRecipes(data.conversation_id);
+        }
       } else {
         setError('No recipes found. Please try different ingredients or check your connection.');
         setConversationId(data.conversation_id); // Still set conversation ID for chat
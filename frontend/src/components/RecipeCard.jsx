@@ -3,6 +3,21 @@ import './RecipeCard.css';
 
 function RecipeCard({ recipe }) {
   const [showDetails, setShowDetails] = useState(false);
+  const [transcript, setTranscript] = useState(recipe.transcript);
+
+  // Listings leave transcripts out; fetch one the first time it is opened
+  const loadTranscript = async (e) => {
+    if (!e.target.open || transcript || !recipe.video_id) return;
+    try {
+      const response = await fetch(`http://localhost:8000/api/transcribe/${recipe.video_id}`);
+      if (response.ok) {
+        const data = await response.json();
+        setTranscript(data.transcript);
+      }
+    } catch (error) {
+      console.error('Error loading transcript:', error);
+    }
+  };
 
   return (
     <div className="recipe-card">
@@ -52,10 +67,12 @@ function RecipeCard({ recipe }) {
           </div>
         )}
 
-        {recipe.transcript && (
-          <details className="transcript-section">
+        {(transcript || recipe.has_transcript) && (
+          <details className="transcript-section" onToggle={loadTranscript}>
             <summary>View Full Transcript</summary>
-            <p className="transcript-text">{recipe.transcript.substring(0, 500)}...</p>
+            <p className="transcript-text">
+              {transcript ? `${transcript.substring(0, 500)}...` : 'Loading transcript...'}
+            </p>
           </details>
         )}
       </div>